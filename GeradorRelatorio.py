@@ -1,13 +1,31 @@
-import math  # <--- Adicione esta importação no topo
+import hashlib
+import os
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from io import BytesIO
+from functools import partial
+from urllib.parse import unquote
+
+import graficos
+from calculos import (
+    COLUNAS_PRODUCAO, COLUNAS_RETIDOS, CHAVES_PARCIAIS, identificar_coluna, ler_e_agregar,
+    somar_parciais, consolidar_parciais, parcial_vazio, linhas_substituidas, listar_fornos, aplicar_grupos_linhas, aplicar_grupos_motivos,
+    montar_cubo, filtrar_motivos, calcular_kpis, adicionar_linhas_gerais, montar_evolucao,
+    JANELA_MOVEL, montar_serie_periodica, calcular_tendencias,
+)
+from graficos import TEMPLATE_GRAFICO
+from exportacao import planilhas_relatorio, exportar_excel
+from diagnostico import Diagnostico, sem_medicao
+from cache_compartilhado import RegistroDatasets
+from consultas import BaseConsultas
+from perfis import ARQUIVO_PERFIS, listar_perfis, listar_versoes, carregar_perfil, salvar_perfil, perfil_padrao, definir_padrao
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(page_title="Gestão de Produção & Qualidade", layout="wide")
-TEMPLATE_GRAFICO = "plotly_white"
 
 # --- CSS PARA IMPRESSÃO (RETRATO) ---
 st.markdown("""
@@ -49,205 +67,306 @@ st.markdown("""
 
 st.title("🏭 Dashboard de Controle de Retidos")
 
+# --- SESSÃO (recursos do processo — cache compartilhado, rastreio de memória — contam as sessões vivas) ---
+def sessao_ativa(sessao):
+    return not runtime.exists() or runtime.get_instance().is_active_session(sessao)
+
+def id_sessao():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else 'local'
+
+# --- DIAGNÓSTICO (opt-in pelo painel da barra lateral; os widgets guardam o estado em session_state) ---
+ARQUIVO_LOG_DIAGNOSTICO = os.environ.get('RETIDOS_DIAGNOSTICO_LOG', 'diagnostico_retidos.jsonl')
+diag = Diagnostico(st.session_state.get('diagnostico_ativo', False),
+                   ARQUIVO_LOG_DIAGNOSTICO if st.session_state.get('diagnostico_log', False) else None,
+                   st.session_state.setdefault('diagnostico_adiados', []), id_sessao(), sessao_ativa)
+
 # --- FUNÇÕES AUXILIARES ---
-def limpar_numero(val):
-    if pd.isna(val): return 0.0
-    if isinstance(val, (int, float)): return float(val)
-    val = str(val).strip().replace('R$', '').replace(' ', '')
-    val = val.replace('.', '').replace(',', '.')
-    try: return float(val)
-    except: return 0.0
-
-@st.cache_data
-def convert_df_to_excel(df):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Dados')
-    return output.getvalue()
-
-def truncar_duas_casas(valor):
-    if pd.isna(valor) or valor == float('inf') or valor == float('-inf'):
-        return 0.0
-    # Multiplica por 100, corta as casas decimais (floor) e divide por 100
-    return math.floor(valor * 100) / 100
-
-def identificar_coluna(df, keywords, nome_padrao_exibicao):
-    colunas_df = [c.lower().strip() for c in df.columns]
-    mapa_cols = {c.lower().strip(): c for c in df.columns} 
-    for kw in keywords:
-        for col in colunas_df:
-            if kw in col:
-                return mapa_cols[col]
-    return None
-
-def carregar_arquivo(uploaded_file):
-    try:
-        if uploaded_file.name.lower().endswith('.csv'):
-            try: return pd.read_csv(uploaded_file)
-            except:
-                uploaded_file.seek(0)
-                return pd.read_csv(uploaded_file, sep=';')
-        else: return pd.read_excel(uploaded_file)
-    except Exception as e: return None
-
-# --- FUNÇÕES DE CÁLCULO E GRÁFICO ---
-def adicionar_linha_geral(df_original, nome_grupo, meta_pct):
-    # Filtra pelo Grupo e cria cópia
-    df_filt = df_original[df_original['Grupo_Relatorio'] == nome_grupo].copy()
-    if df_filt.empty: return df_filt
-
-    total_prod = df_filt['M2_Produzido'].sum()
-    total_ret = df_filt['M2_Retido'].sum()
-    meta_m2_total = total_prod * (meta_pct / 100)
-    saldo_total = meta_m2_total - total_ret
-    # Cálculo com truncamento (sem arredondar para cima)
-    pct_calc = (total_ret / total_prod * 100) if total_prod > 0 else 0
-    pct_geral = truncar_duas_casas(pct_calc)
-    
-    row_geral = pd.DataFrame({
-        'Grupo_Relatorio': [nome_grupo], 'Equipe': ['Média Geral'], 
-        'M2_Produzido': [total_prod], 'M2_Retido': [total_ret],
-        'Meta_M2': [meta_m2_total], 'Saldo_M2': [saldo_total], '% Realizado': [pct_geral]
+def exportar_relatorio(df_tabela_final, cubo_prod, cubo_ret, config):
+    # Chamado só no clique do download: monta as abas e devolve o BytesIO do xlsxwriter sem cópias extras
+    planilhas = planilhas_relatorio(df_tabela_final, montar_evolucao(cubo_prod, cubo_ret), cubo_ret)
+    return exportar_excel(planilhas, config)
+
+# --- CACHE DE INGESTÃO (evita reler os arquivos a cada interação e entre sessões) ---
+MAX_ARQUIVOS_CACHE = 8
+ORCAMENTO_CACHE_MB = float(os.environ.get('RETIDOS_CACHE_MB', 512))
+
+@st.cache_resource
+def registro_datasets():
+    # Um único registro por processo do servidor: supervisores que enviam o mesmo extrato compartilham a mesma cópia
+    return RegistroDatasets(ORCAMENTO_CACHE_MB * 1e6, sessao_ativa)
+
+def _ler_e_tratar(conteudo, nome_arquivo, tipo, medir=sem_medicao):
+    arquivo = BytesIO(conteudo)
+    arquivo.name = nome_arquivo
+    with st.spinner("Lendo arquivo..."):
+        return ler_e_agregar(arquivo, tipo, medir=medir)
+
+def carregar_arquivo_cache(uploaded_file, tipo, medir=sem_medicao):
+    # A chave é (hash do conteúdo, nome/extensão, tipo); a leitura só acontece se nenhuma sessão tiver o arquivo
+    if 'cache_ingestao' not in st.session_state:
+        st.session_state.cache_ingestao = {'hits': 0, 'misses': 0}
+    conteudo = uploaded_file.getvalue()
+    hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+    chave = (hash_arquivo, uploaded_file.name.lower(), tipo)
+    with medir(f"upload_{tipo}") as registro:
+        df, acerto = registro_datasets().obter(chave, partial(_ler_e_tratar, conteudo, chave[1], tipo, medir), id_sessao())
+        if df is not None: registro['linhas'] = int(df['qtd'].sum())
+    st.session_state.cache_ingestao['hits' if acerto else 'misses'] += 1
+    if df is None: return None
+    # Cópia rasa (sem copiar dados): com o copy-on-write do pandas 3 (exigido no requirements.txt), colunas
+    # novas e attrs desta sessão ficam só nela e o conjunto compartilhado continua intacto
+    df = df.copy(deep=False)
+    df.attrs['hash_arquivo'] = hash_arquivo
+    df.attrs['chave_cache'] = chave
+    return df
+
+# --- HISTÓRICO LOCAL (Parquet particionado por mes_ano, guarda as somas parciais) ---
+PASTA_HISTORICO = os.environ.get('RETIDOS_HISTORICO', 'historico_retidos')
+COLUNAS_HISTORICO = {
+    'producao': CHAVES_PARCIAIS['producao'] + ['metragem_real', 'qtd', 'arquivo_origem'],
+    'retidos': CHAVES_PARCIAIS['retidos'] + ['m2_real', 'qtd', 'arquivo_origem'],
+}
+# Linhas com data não reconhecida (mes_ano vazio) ficam numa partição própria e voltam sem mês ao serem lidas,
+# como num upload; 'Sem Data' continua sendo só o mês dos arquivos sem coluna de data
+MES_DATA_INVALIDA = 'Data Inválida'
+
+def pastas_meses(tipo):
+    # {mes_ano: pasta da partição}; o pyarrow grava o nome da partição codificado como URL ('Sem%20Data')
+    pasta = os.path.join(PASTA_HISTORICO, tipo)
+    if not os.path.isdir(pasta): return {}
+    return {unquote(d.split('=', 1)[1]): os.path.join(pasta, d) for d in os.listdir(pasta) if d.startswith('mes_ano=')}
+
+def salvar_historico(df, tipo, hash_arquivo):
+    # Um arquivo por upload e por mês, nomeado pelo hash: salvar o mesmo upload de novo só sobrescreve.
+    # Mesma regra do acumulado (linhas_substituidas): os pares (forno, dia) trazidos saem dos arquivos de
+    # uploads anteriores, então uma reexportação não soma duas vezes. Devolve quantas linhas originais saíram
+    df_salvar = df.assign(mes_ano=df['mes_ano'].astype(object).fillna(MES_DATA_INVALIDA), arquivo_origem=hash_arquivo)
+    removidas = 0
+    pastas = pastas_meses(tipo)
+    for mes in df_salvar['mes_ano'].unique():
+        if mes not in pastas: continue
+        for entrada in os.scandir(pastas[mes]):
+            if entrada.name.startswith(hash_arquivo[:16]): continue
+            anterior = pd.read_parquet(entrada.path)
+            substituir = linhas_substituidas(anterior, df)
+            if not substituir.any(): continue
+            removidas += int(anterior.loc[substituir, 'qtd'].sum())
+            if substituir.all(): os.remove(entrada.path)
+            else: anterior[~substituir].to_parquet(entrada.path, index=False)
+    df_salvar.to_parquet(os.path.join(PASTA_HISTORICO, tipo), partition_cols=['mes_ano'], index=False,
+                         basename_template=f"{hash_arquivo[:16]}-{{i}}.parquet",
+                         existing_data_behavior='overwrite_or_ignore')
+    return removidas
+
+def listar_meses_historico():
+    return sorted(set().union(*(pastas_meses(tipo) for tipo in COLUNAS_HISTORICO)))
+
+def assinatura_historico(tipo, meses):
+    # Lista (arquivo, mtime) das partições pedidas: muda sempre que algo é gravado nelas
+    assinatura = []
+    pastas = pastas_meses(tipo)
+    for mes in meses:
+        if mes in pastas:
+            assinatura += [(f.name, f.stat().st_mtime) for f in os.scandir(pastas[mes])]
+    return tuple(sorted(assinatura))
+
+def carregar_historico(tipo, meses, assinatura):
+    pasta = os.path.join(PASTA_HISTORICO, tipo)
+    # Mês sem partição deste tipo (ex.: 'Sem Data' só na produção): parcial vazio, já com os tipos certos
+    if not meses or not assinatura: return parcial_vazio(tipo).assign(arquivo_origem=pd.Series(dtype=str))[COLUNAS_HISTORICO[tipo]]
+    # Só as partições dos meses pedidos são lidas (filtro aplicado no diretório)
+    df = pd.read_parquet(pasta, filters=[('mes_ano', 'in', list(meses))], memory_map=True)
+    df['mes_ano'] = df['mes_ano'].astype(str).replace(MES_DATA_INVALIDA, None)
+    return df[COLUNAS_HISTORICO[tipo]]
+
+@st.cache_data(max_entries=MAX_ARQUIVOS_CACHE, show_spinner="Carregando histórico...")
+def parcial_historico(tipo, meses, assinatura):
+    return somar_parciais([carregar_historico(tipo, meses, assinatura)], tipo)
+
+def fontes_parciais(df_upload, tipo, meses):
+    # Cada fonte tem um identificador estável: hash do upload ou assinatura das partições do histórico
+    fontes = []
+    if meses:
+        assinatura = assinatura_historico(tipo, meses)
+        id_hist = 'hist-' + hashlib.sha256(repr((tuple(meses), assinatura)).encode()).hexdigest()
+        fontes.append((id_hist, parcial_historico(tipo, tuple(meses), assinatura)))
+    if df_upload is not None:
+        fontes.append((df_upload.attrs['hash_arquivo'], df_upload))
+    return fontes
+
+# --- PERFIS DE CONFIGURAÇÃO ---
+def aplicar_perfil(perfil, todos_fornos):
+    # Só troca os mapas da sessão: os dados já lidos são remapeados no próximo rerun, sem reler arquivos
+    config = perfil['config']
+    st.session_state.mapa_fornos_df = pd.DataFrame({
+        'Código no Arquivo': todos_fornos,
+        'Nome da Linha (Edite aqui)': [config['mapa_fornos'].get(f, f) for f in todos_fornos]
     })
-    
-    df_filt['Equipe'] = df_filt['Equipe'].astype(str)
-    df_final = pd.concat([df_filt, row_geral], ignore_index=True)
-    df_final['Ordem'] = df_final['Equipe'].apply(lambda x: 1 if x == 'Média Geral' else 0)
-    df_final = df_final.sort_values(by=['Ordem', 'Equipe'])
-    return df_final
-
-def criar_tabela_grafica(df, meta_pct):
-    if df.empty: return None
-    cor_texto_pct = ['#E74C3C' if v > meta_pct else '#27AE60' for v in df['% Realizado']]
-    cor_texto_saldo = ['#E74C3C' if v < 0 else '#27AE60' for v in df['Saldo_M2']]
-    
-    fig = go.Figure(data=[go.Table(
-        header=dict(values=['<b>Grupo</b>', '<b>Equipe</b>', '<b>Produção</b>', '<b>Meta (m²)</b>', '<b>Retido (m²)</b>', '<b>Saldo</b>', '<b>% Perda</b>'],
-                    fill_color='#2E86C1', align='center', font=dict(color='white', size=12)),
-        cells=dict(values=[df['Grupo_Relatorio'], df['Equipe'], 
-                           [f"{v:,.2f}" for v in df['M2_Produzido']], 
-                           [f"{v:,.2f}" for v in df['Meta_M2']], 
-                           [f"{v:,.2f}" for v in df['M2_Retido']], 
-                           [f"{v:,.2f}" for v in df['Saldo_M2']], 
-                           [f"{v:.2f}%" for v in df['% Realizado']]],
-                   fill_color='#F7F9F9', align='center',
-                   font=dict(color=['black', 'black', 'black', 'black', 'black', cor_texto_saldo, cor_texto_pct], size=11),
-                   height=30))])
-    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), height=400)
-    return fig
-
-def criar_grafico_evolucao_com_geral(df_prod, df_ret, nome_grupo, meta_pct):
-    df_p = df_prod[df_prod['Grupo_Relatorio'] == nome_grupo].copy()
-    df_r = df_ret[df_ret['Grupo_Relatorio'] == nome_grupo].copy()
-    if df_p.empty and df_r.empty: return None
-    
-    # Agrupa por Mês/Equipe (Somando tudo dentro do grupo)
-    p_eq = df_p.groupby(['mes_ano', 'Equipe'])['metragem_real'].sum().reset_index().rename(columns={'metragem_real': 'M2_Produzido'})
-    r_eq = df_r.groupby(['mes_ano', 'Equipe'])['m2_real'].sum().reset_index().rename(columns={'m2_real': 'M2_Retido'})
-    
-    if not df_p.empty:
-        p_tot = df_p.groupby(['mes_ano'])['metragem_real'].sum().reset_index().rename(columns={'metragem_real': 'M2_Produzido'})
-        p_tot['Equipe'] = 'Média Geral'
-    else: p_tot = pd.DataFrame()
-
-    if not df_r.empty:
-        r_tot = df_r.groupby(['mes_ano'])['m2_real'].sum().reset_index().rename(columns={'m2_real': 'M2_Retido'})
-        r_tot['Equipe'] = 'Média Geral'
-    else: r_tot = pd.DataFrame()
-
-    df_final = pd.merge(pd.concat([p_eq, p_tot]), pd.concat([r_eq, r_tot]), on=['mes_ano', 'Equipe'], how='outer').fillna(0)
-    df_final['Meta_M2'] = df_final['M2_Produzido'] * (meta_pct / 100)
-    df_final['Cor_Barra'] = df_final.apply(lambda row: '#27AE60' if row['M2_Retido'] <= row['Meta_M2'] else '#E74C3C', axis=1)
-    df_final['Ordem_Equipe'] = df_final['Equipe'].apply(lambda x: 1 if x == 'Média Geral' else 0)
-    df_final = df_final.sort_values(by=['mes_ano', 'Ordem_Equipe', 'Equipe'])
-    
-    # --- ALTERAÇÃO AQUI: Apenas o nome da equipe no Label_X ---
-    df_final['Label_X'] = df_final['Equipe'].astype(str)
-    
-    fig = go.Figure()
-    # Barra Retido
-    fig.add_trace(go.Bar(x=df_final['Label_X'], y=df_final['M2_Retido'], marker_color=df_final['Cor_Barra'],
-                         text=[f"{v:,.2f}" for v in df_final['M2_Retido']], textposition='inside', name='Realizado'))
-    
-    # Linha Meta com Texto (Preto)
-    fig.add_trace(go.Scatter(
-        x=df_final['Label_X'], 
-        y=df_final['Meta_M2'], 
-        mode='lines+markers+text',
-        text=[f"{v:,.1f}" for v in df_final['Meta_M2']], 
-        textposition="top center",
-        textfont=dict(color='black'), 
-        marker=dict(symbol='line-ew', color='black', size=10, line=dict(width=2)), 
-        line=dict(color='black', dash='dot'),
-        name='Meta M²'
-    ))
-    
-    max_val = max(df_final['M2_Retido'].max(), df_final['Meta_M2'].max()) if not df_final.empty else 100
-    fig.update_layout(title=f"{nome_grupo}: M²", yaxis=dict(range=[0, max_val * 1.3]), template=TEMPLATE_GRAFICO, showlegend=True)
-    return fig
+    st.session_state.pop('editor_fornos', None)  # descarta as edições feitas sobre a tabela anterior
+    st.session_state.grupos_linhas = dict(config['grupos_linhas'])
+    st.session_state.grupos_motivos = dict(config['grupos_motivos'])
+    st.session_state.perfil_ativo = (perfil['nome'], perfil['versao'])
+
+# --- MOTOR DE CONSULTAS (análise por motivo, Top 10 e detalhamento motivo × linha × dia) ---
+def _montar_base_consultas(df_ret):
+    with st.spinner("Carregando o motor de consultas..."), diag.etapa('carga_consultas', len(df_ret)):
+        return BaseConsultas(df_ret)
+
+def base_consultas(df_ret, ids_fontes):
+    # Os fatos são carregados uma vez por conjunto de fontes e compartilhados entre as sessões (mesmo registro e
+    # orçamento dos uploads); a sessão guarda só a própria conexão, com os mapeamentos dela. Devolve (consultas, chave)
+    chave = ('consultas', ids_fontes)
+    base, _ = registro_datasets().obter(chave, partial(_montar_base_consultas, df_ret), id_sessao())
+    atual = st.session_state.get('consultas_sessao')
+    if atual is None or atual.base is not base:
+        atual = base.sessao()
+        st.session_state.consultas_sessao = atual
+    return atual, chave
+
+# --- FUNÇÕES DE GRÁFICO ---
+def aba_aberta(aba):
+    # 'open' é None quando as abas não rastreiam seleção (modo leve desligado): aí todas executam
+    return aba.open is not False
+
+# Figuras são memorizadas pelo hash da fatia de dados + metas: mudar algo em outra aba não as reconstrói
+MAX_FIGURAS_CACHE = 64
+memorizar_figura = st.cache_data(max_entries=MAX_FIGURAS_CACHE, show_spinner=False)
+criar_grafico_pct_grupo = diag.envolver('grafico_pct_grupo', memorizar_figura(graficos.criar_grafico_pct_grupo))
+criar_grafico_top_causas = diag.envolver('grafico_top_causas', memorizar_figura(graficos.criar_grafico_top_causas))
+criar_tabela_grafica = diag.envolver('tabela_grafica', memorizar_figura(graficos.criar_tabela_grafica))
+criar_grafico_evolucao_com_geral = diag.envolver('grafico_evolucao', memorizar_figura(graficos.criar_grafico_evolucao_com_geral))
+criar_mapa_calor_motivo = diag.envolver('mapa_calor_motivo', memorizar_figura(graficos.criar_mapa_calor_motivo))
+criar_grafico_controle = diag.envolver('grafico_controle', memorizar_figura(graficos.criar_grafico_controle))
 
 # --- BARRA LATERAL ---
 with st.sidebar:
     st.header("1. Upload de Dados")
     file_prod = st.file_uploader("📂 Arquivo de Produção", type=["xlsx", "csv"])
     file_ret = st.file_uploader("📂 Arquivo de Retidos", type=["xlsx", "csv"])
+    with st.expander("💾 Histórico Local"):
+        SALVAR_HISTORICO = st.checkbox("Salvar uploads no histórico", value=False)
+        MESES_HISTORICO = st.multiselect("Meses do histórico a carregar", listar_meses_historico())
+        MODO_INCREMENTAL = st.checkbox("➕ Acumular uploads (modo incremental)", value=False,
+                                       help="Cada novo arquivo é somado ao que já foi carregado nesta sessão. Dias repetidos de um mesmo forno são substituídos.")
+        if st.button("🧹 Zerar acumulado"):
+            st.session_state.pop('acumulado', None)
     st.markdown("---")
     st.header("2. Metas Gerais")
     META_PCT = st.slider("🎯 % Máximo de Perda (Geral)", 0.0, 5.0, 0.5, 0.1)
+    MODO_LEVE = st.toggle("⚡ Calcular só a aba aberta", value=True)
+    with st.expander("🩺 Diagnóstico de Desempenho"):
+        st.toggle("Medir tempo e memória por etapa", key='diagnostico_ativo')
+        st.checkbox(f"Anexar medições em {ARQUIVO_LOG_DIAGNOSTICO}", key='diagnostico_log')
+        painel_diagnostico = st.container()
     st.markdown("---")
     st.header("3. Análise Específica")
     st.info("Configuração para a aba 'Análise por Motivo'")
 
 # --- LÓGICA PRINCIPAL ---
-if file_prod and file_ret:
-    # 1. Carregamento
-    df_prod = carregar_arquivo(file_prod)
-    df_ret = carregar_arquivo(file_ret)
+if (file_prod and file_ret) or MESES_HISTORICO:
+    # 1. Carregamento (lido, limpo e já reduzido às somas parciais; cacheado pelo hash do conteúdo)
+    df_prod = carregar_arquivo_cache(file_prod, 'producao', diag.etapa) if file_prod else None
+    df_ret = carregar_arquivo_cache(file_ret, 'retidos', diag.etapa) if file_ret else None
 
-    if df_prod is None or df_ret is None:
+    if (file_prod and df_prod is None) or (file_ret and df_ret is None):
         st.error("Erro na leitura dos arquivos.")
         st.stop()
 
+    chaves_uploads = [df.attrs['chave_cache'] for df in (df_prod, df_ret) if df is not None]
+
+    if 'cache_ingestao' in st.session_state:
+        stats_cache = st.session_state.cache_ingestao
+        stats_registro = registro_datasets().estatisticas()
+        st.sidebar.caption(f"🗄️ Cache de arquivos: {stats_cache['hits']} acertos / {stats_cache['misses']} leituras · "
+                           f"compartilhado: {stats_registro['conjuntos']} conjunto(s), {stats_registro['bytes'] / 1e6:.1f} de "
+                           f"{stats_registro['orcamento_bytes'] / 1e6:.0f} MB, {stats_registro['sessoes']} sessão(ões)")
+    for nome_df, df_aviso in [('Produção', df_prod), ('Retidos', df_ret)]:
+        if df_aviso is not None and df_aviso.attrs.get('celulas_invalidas', 0):
+            st.sidebar.warning(f"⚠️ {nome_df}: {df_aviso.attrs['celulas_invalidas']} células de metragem não numéricas foram consideradas 0.")
+        if df_aviso is not None and df_aviso.attrs.get('datas_invalidas', 0):
+            st.sidebar.warning(f"⚠️ {nome_df}: {df_aviso.attrs['datas_invalidas']} linhas com data não reconhecida ficaram fora da evolução mensal.")
+
+    if SALVAR_HISTORICO:
+        # {hash do upload salvo: linhas de uploads anteriores que ele substituiu no histórico}
+        if 'historico_salvo' not in st.session_state: st.session_state.historico_salvo = {}
+        for tipo, df_salvar in [('producao', df_prod), ('retidos', df_ret)]:
+            if df_salvar is not None and df_salvar.attrs['hash_arquivo'] not in st.session_state.historico_salvo:
+                st.session_state.historico_salvo[df_salvar.attrs['hash_arquivo']] = salvar_historico(df_salvar, tipo, df_salvar.attrs['hash_arquivo'])
+    for nome_df, df_aviso in [('Produção', df_prod), ('Retidos', df_ret)]:
+        if df_aviso is not None and st.session_state.get('historico_salvo', {}).get(df_aviso.attrs['hash_arquivo']):
+            removidas = st.session_state.historico_salvo[df_aviso.attrs['hash_arquivo']]
+            st.sidebar.warning(f"⚠️ Histórico de {nome_df}: {removidas} linha(s) de uploads anteriores foram substituídas "
+                               "por este arquivo (mesmo forno e dia).")
+
+    # Daqui em diante trabalha-se só com as somas parciais (forno × equipe × dia), não com as linhas
+    if MODO_INCREMENTAL:
+        if 'acumulado' not in st.session_state:
+            st.session_state.acumulado = {t: {'fontes': [], 'parcial': None} for t in ['producao', 'retidos']}
+        estado_prod, estado_ret = st.session_state.acumulado['producao'], st.session_state.acumulado['retidos']
+    else: estado_prod, estado_ret = None, None
+    fontes_ret = fontes_parciais(df_ret, 'retidos', MESES_HISTORICO)
+    with diag.etapa('consolidacao'):
+        df_prod = consolidar_parciais(fontes_parciais(df_prod, 'producao', MESES_HISTORICO), 'producao', estado_prod)
+        df_ret = consolidar_parciais(fontes_ret, 'retidos', estado_ret)
+    # Identidade dos dados de retidos (fontes incorporadas): é o que decide recarregar o motor de consultas
+    ids_retidos = tuple(estado_ret['fontes']) if MODO_INCREMENTAL else tuple(i for i, _ in fontes_ret)
+    if df_prod is None or df_ret is None:
+        st.info("Envie os dois arquivos para iniciar o acumulado.")
+        st.stop()
+    if MODO_INCREMENTAL:
+        st.sidebar.caption(f"➕ Acumulado: {len(estado_prod['fontes'])} fonte(s) de produção, {len(estado_ret['fontes'])} de retidos")
+        for nome_estado, estado in [('Produção', estado_prod), ('Retidos', estado_ret)]:
+            if estado.get('linhas_substituidas'):
+                st.sidebar.warning(f"⚠️ {nome_estado}: {estado['linhas_substituidas']} linha(s) de arquivos anteriores foram "
+                                   "substituídas pelas do arquivo mais recente (mesmo forno e dia; linhas sem data contam como um dia).")
+
     # 2. Identificação de Colunas
     erros_mapeamento = []
     # Prod
-    col_equipe_p = identificar_coluna(df_prod, ['equipe', 'team', 'turno'], 'Equipe')
-    col_forno_p = identificar_coluna(df_prod, ['forno', 'linha', 'maq'], 'Forno/Linha')
-    col_metragem = identificar_coluna(df_prod, ['metragem', 'm2', 'prod'], 'Metragem/Produção')
-    col_data_p = identificar_coluna(df_prod, ['data', 'date', 'dia'], 'Data') 
+    col_equipe_p = identificar_coluna(df_prod, COLUNAS_PRODUCAO['Equipe'], 'Equipe')
+    col_forno_p = identificar_coluna(df_prod, COLUNAS_PRODUCAO['Forno'], 'Forno/Linha')
+    col_metragem = identificar_coluna(df_prod, ['metragem_real'], 'Metragem/Produção')
     # Ret
-    col_motivo = identificar_coluna(df_ret, ['motivo', 'defeito', 'causa'], 'Motivo')
-    col_m2 = identificar_coluna(df_ret, ['m²', 'm2', 'metragem', 'quant'], 'M2 Retido')
-    col_equipe_r = identificar_coluna(df_ret, ['equipe', 'team', 'turno'], 'Equipe')
-    col_forno_r = identificar_coluna(df_ret, ['forno', 'linha', 'maq'], 'Forno/Linha')
-    col_data_r = identificar_coluna(df_ret, ['data', 'date', 'dia', 'hora'], 'Data')
+    col_motivo = identificar_coluna(df_ret, COLUNAS_RETIDOS['Motivo'], 'Motivo')
+    col_m2 = identificar_coluna(df_ret, ['m2_real'], 'M2 Retido')
+    col_equipe_r = identificar_coluna(df_ret, COLUNAS_RETIDOS['Equipe'], 'Equipe')
+    col_forno_r = identificar_coluna(df_ret, COLUNAS_RETIDOS['Forno'], 'Forno/Linha')
 
     cols_obrigatorias = [col_equipe_p, col_forno_p, col_metragem, col_motivo, col_m2, col_equipe_r, col_forno_r]
     if any(c is None for c in cols_obrigatorias):
         st.error("Colunas obrigatórias não encontradas. Verifique os nomes no Excel.")
         st.stop()
 
-    # Tratamento Inicial
-    df_prod['metragem_real'] = df_prod[col_metragem].apply(limpar_numero)
-    if col_data_p:
-        df_prod['data_obj'] = pd.to_datetime(df_prod[col_data_p], dayfirst=True, errors='coerce')
-        df_prod['mes_ano'] = df_prod['data_obj'].dt.strftime('%Y-%m')
-    else: df_prod['mes_ano'] = 'Sem Data'
+    # Tratamento Inicial (metragem_real, m2_real e mes_ano) já vem do cache de ingestão; 'qtd' conta as linhas originais
 
-    df_ret['m2_real'] = df_ret[col_m2].apply(limpar_numero)
-    if col_data_r:
-        df_ret['data_obj'] = pd.to_datetime(df_ret[col_data_r], dayfirst=True, errors='coerce')
-        df_ret['mes_ano'] = df_ret['data_obj'].dt.strftime('%Y-%m')
-    else: df_ret['mes_ano'] = 'Sem Data'
+    todos_fornos = listar_fornos(df_prod, df_ret)
+
+    # --- PERFIS DE CONFIGURAÇÃO (o perfil padrão é aplicado ao abrir a sessão) ---
+    if 'perfil_ativo' not in st.session_state:
+        st.session_state.perfil_ativo = None
+        if perfil_padrao(): aplicar_perfil(carregar_perfil(perfil_padrao()), todos_fornos)
 
-    # --- FUNCIONALIDADE: MAPEAMENTO DE FORNOS ---
     st.sidebar.markdown("---")
+    painel_perfis = st.sidebar.expander("📁 Perfis de Configuração")
+    with painel_perfis:
+        if st.session_state.perfil_ativo:
+            st.caption(f"Perfil ativo: **{st.session_state.perfil_ativo[0]}** (v{st.session_state.perfil_ativo[1]})")
+        perfis_salvos = listar_perfis()
+        if perfis_salvos:
+            perfil_escolhido = st.selectbox("Perfil", perfis_salvos)
+            versao_escolhida = st.selectbox("Versão", listar_versoes(perfil_escolhido)[::-1],
+                                            format_func=lambda v: f"v{v['versao']} · {v['salvo_em']}")
+            c_pf1, c_pf2 = st.columns(2)
+            if c_pf1.button("📂 Carregar"):
+                aplicar_perfil(carregar_perfil(perfil_escolhido, versao_escolhida['versao']), todos_fornos)
+                st.rerun()
+            if c_pf2.button("⭐ Padrão"): definir_padrao(perfil_escolhido)
+        else: st.caption(f"Nenhum perfil salvo em {ARQUIVO_PERFIS}.")
+
+    # --- FUNCIONALIDADE: MAPEAMENTO DE FORNOS ---
     with st.sidebar.expander("🛠️ Configuração de Linhas/Fornos", expanded=True):
         st.write("Determine qual Forno pertence a qual Linha.")
-        
-        fornos_prod = df_prod[col_forno_p].dropna().unique().tolist()
-        fornos_ret = df_ret[col_forno_r].dropna().unique().tolist()
-        todos_fornos = sorted(list(set([str(x) for x in fornos_prod + fornos_ret])))
 
         if 'mapa_fornos_df' not in st.session_state:
             st.session_state.mapa_fornos_df = pd.DataFrame({
@@ -295,17 +414,9 @@ if file_prod and file_ret:
                 st.rerun()
 
     # --- APLICAÇÃO DO MAPEAMENTO ---
-    df_prod['Linha_Nome'] = df_prod[col_forno_p].astype(str).map(mapa_de_para_linhas).fillna('Outros')
-    df_ret['Linha_Nome'] = df_ret[col_forno_r].astype(str).map(mapa_de_para_linhas).fillna('Outros')
-
-    def definir_grupo_relatorio(linha_nome):
-        for nome_grupo, lista_linhas in st.session_state.grupos_linhas.items():
-            if linha_nome in lista_linhas:
-                return nome_grupo
-        return linha_nome 
-
-    df_prod['Grupo_Relatorio'] = df_prod['Linha_Nome'].apply(definir_grupo_relatorio)
-    df_ret['Grupo_Relatorio'] = df_ret['Linha_Nome'].apply(definir_grupo_relatorio)
+    with diag.etapa('mapeamento_linhas', len(df_prod) + len(df_ret)):
+        aplicar_grupos_linhas(df_prod, mapa_de_para_linhas, st.session_state.grupos_linhas)
+        aplicar_grupos_linhas(df_ret, mapa_de_para_linhas, st.session_state.grupos_linhas)
 
     # --- SIDEBAR: ANÁLISE ESPECÍFICA E FILTROS DE MOTIVO ---
     todos_motivos_brutos = sorted(df_ret[col_motivo].astype(str).unique())
@@ -323,11 +434,10 @@ if file_prod and file_ret:
     st.sidebar.write("**Filtros de Motivos**")
     motivos_excluir = st.sidebar.multiselect("🗑️ Excluir Motivos da Análise", options=todos_motivos_brutos)
     
-    df_ret_filtrado = df_ret[~df_ret[col_motivo].isin(motivos_excluir)].copy() if motivos_excluir else df_ret.copy()
 
     if 'grupos_motivos' not in st.session_state: st.session_state.grupos_motivos = {}
     with st.sidebar.expander("➕ Agrupar Defeitos/Motivos"):
-        motivos_disp = sorted(df_ret_filtrado[col_motivo].unique())
+        motivos_disp = sorted(m for m in df_ret[col_motivo].dropna().unique() if m not in motivos_excluir)
         selecao_mot = st.multiselect("Selecione os Motivos:", motivos_disp)
         nome_grupo_mot = st.text_input("Nome do Grupo de Defeito")
         if st.button("Salvar Grupo Defeito") and selecao_mot and nome_grupo_mot:
@@ -342,171 +452,234 @@ if file_prod and file_ret:
         for r in remover_mot: del st.session_state.grupos_motivos[r]
         if remover_mot: st.rerun()
 
-    def definir_motivo_analise(m):
-        for g, l in st.session_state.grupos_motivos.items():
-            if m in l: return g
-        return m
-    df_ret_filtrado['Motivo_Analise'] = df_ret_filtrado[col_motivo].apply(definir_motivo_analise)
-
-    # --- CÁLCULOS KPI GERAL ---
-    df_p_agg = df_prod.rename(columns={col_equipe_p: 'Equipe'})
-    df_r_agg = df_ret_filtrado.rename(columns={col_equipe_r: 'Equipe'})
+    with diag.etapa('mapeamento_motivos', len(df_ret)):
+        aplicar_grupos_motivos(df_ret, st.session_state.grupos_motivos)
+    consultas, chave_consultas = base_consultas(df_ret, ids_retidos)
+    consultas.mapear(mapa_de_para_linhas, st.session_state.grupos_linhas, st.session_state.grupos_motivos)
+    # Esta sessão passa a referenciar só os arquivos e a base de consultas atuais; os anteriores podem ser descartados
+    registro_datasets().usar(id_sessao(), chaves_uploads + [chave_consultas])
+
+    with painel_perfis:
+        nome_perfil = st.text_input("Salvar configuração atual como",
+                                    value=st.session_state.perfil_ativo[0] if st.session_state.perfil_ativo else "")
+        if st.button("💾 Salvar perfil") and nome_perfil:
+            versao = salvar_perfil(nome_perfil, {'mapa_fornos': mapa_de_para_linhas,
+                                                 'grupos_linhas': st.session_state.grupos_linhas,
+                                                 'grupos_motivos': st.session_state.grupos_motivos})
+            st.session_state.perfil_ativo = (nome_perfil, versao)
+            st.rerun()
 
-    # Agrupa por Grupo_Relatorio e Equipe (Soma tudo o que estiver dentro do grupo)
-    prod_agg = df_p_agg.groupby(['Grupo_Relatorio', 'Equipe'])['metragem_real'].sum().reset_index().rename(columns={'metragem_real': 'M2_Produzido'})
-    ret_agg = df_r_agg.groupby(['Grupo_Relatorio', 'Equipe'])['m2_real'].sum().reset_index().rename(columns={'m2_real': 'M2_Retido'})
-    
-    df_final = pd.merge(prod_agg, ret_agg, on=['Grupo_Relatorio', 'Equipe'], how='outer').fillna(0)
+    # --- CÁLCULOS KPI GERAL (cubo Grupo × Equipe × Mês × Motivo montado numa só passada) ---
+    with diag.etapa('calculo_kpis', len(df_prod) + len(df_ret)):
+        cubo_prod, cubo_ret = montar_cubo(df_prod, df_ret)
+        cubo_ret_filtrado = filtrar_motivos(cubo_ret, motivos_excluir)
+        df_final = calcular_kpis(cubo_prod, cubo_ret_filtrado, META_PCT)
+        grupos_unicos = sorted(df_final['Grupo_Relatorio'].unique())
     
-    df_final['Meta_M2'] = df_final['M2_Produzido'] * (META_PCT / 100)
-    df_final['Saldo_M2'] = df_final['Meta_M2'] - df_final['M2_Retido']
-# Calcula o percentual bruto e depois aplica o truncamento linha a linha
-    pct_raw = (df_final['M2_Retido'] / df_final['M2_Produzido']) * 100
-    df_final['% Realizado'] = pct_raw.apply(truncar_duas_casas)    
-    grupos_unicos = sorted(df_final['Grupo_Relatorio'].unique())
-    
-    df_tabela_consolidadas = []
-    for grupo in grupos_unicos:
-        df_grupo = adicionar_linha_geral(df_final, grupo, META_PCT)
-        if df_grupo is not None:
-            df_grupo['Status'] = df_grupo['% Realizado'].apply(lambda x: 'Dentro da Meta (Verde)' if x <= META_PCT else 'Fora da Meta (Vermelho)')
-            df_tabela_consolidadas.append(df_grupo)
-            
-    df_tabela_final = pd.concat(df_tabela_consolidadas, ignore_index=True) if df_tabela_consolidadas else pd.DataFrame()
+        df_tabela_final = adicionar_linhas_gerais(df_final, META_PCT)
 
     # --- DASHBOARD ---
-    tab1, tab2, tab3 = st.tabs(["📊 Resultados Consolidados", "🔍 Análise por Motivo", "💾 Dados Brutos"])
+    # Com o modo leve, só a aba aberta executa seus cálculos (trocar de aba provoca um rerun)
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Resultados Consolidados", "🔍 Análise por Motivo", "💾 Dados Brutos", "📉 Tendências (CEP)"],
+                               key='abas_dashboard', on_change='rerun' if MODO_LEVE else 'ignore')
 
     with tab1:
-        st.subheader(f"📈 Indicadores Gerais (Meta de {META_PCT}%)")
+        if aba_aberta(tab1):
+            # Fatias por grupo separadas uma única vez (os laços abaixo só consultam os dicionários)
+            with diag.etapa('fatias_por_grupo', len(cubo_ret_filtrado)):
+                tabela_por_grupo = dict(tuple(df_tabela_final.groupby('Grupo_Relatorio', sort=False, observed=True))) if not df_tabela_final.empty else {}
+                pct_geral_grupo = df_tabela_final[df_tabela_final['Equipe'] == 'Média Geral'].set_index('Grupo_Relatorio')['% Realizado'] if not df_tabela_final.empty else pd.Series(dtype=float)
+                evolucao_por_grupo = dict(tuple(montar_evolucao(cubo_prod, cubo_ret_filtrado).groupby('Grupo_Relatorio', sort=False, observed=True)))
+                top_por_grupo = consultas.top_causas(10, motivos_excluir)
+
+            st.subheader(f"📈 Indicadores Gerais (Meta de {META_PCT}%)")
         
-        if grupos_unicos:
-            cols = st.columns(len(grupos_unicos))
-            for idx, grupo in enumerate(grupos_unicos):
-                with cols[idx]:
-                    st.info(f"**{grupo}**")
-                    if not df_tabela_final.empty:
-                        row = df_tabela_final[(df_tabela_final['Grupo_Relatorio'] == grupo) & (df_tabela_final['Equipe'] == 'Média Geral')]
-                        if not row.empty:
-                            val = row['% Realizado'].values[0]
+            if grupos_unicos:
+                cols = st.columns(len(grupos_unicos))
+                for idx, grupo in enumerate(grupos_unicos):
+                    with cols[idx]:
+                        st.info(f"**{grupo}**")
+                        if grupo in pct_geral_grupo.index:
+                            val = pct_geral_grupo[grupo]
                             st.metric("Resultado", f"{val:.2f}%")
                             if val <= META_PCT: st.markdown(":green[**Dentro da Meta**]")
                             else: st.markdown(":red[**Fora da Meta**]")
         
-            st.markdown("---")
-            st.subheader(f"📊 Performance por Equipe em %")
+                st.markdown("---")
+                st.subheader(f"📊 Performance por Equipe em %")
             
-            cols_g = st.columns(len(grupos_unicos))
-            mapa_cores = {'Dentro da Meta (Verde)': '#27AE60', 'Fora da Meta (Vermelho)': '#E74C3C'}
+                cols_g = st.columns(len(grupos_unicos))
             
-            for idx, grupo in enumerate(grupos_unicos):
-                with cols_g[idx]:
-                    df_g = df_tabela_final[df_tabela_final['Grupo_Relatorio'] == grupo]
-                    if not df_g.empty:
-                        fig = go.Figure(go.Bar(x=df_g['Equipe'], y=df_g['% Realizado'],
-                                                marker_color=[mapa_cores.get(s, '#333') for s in df_g['Status']],
-                                                text=[f"{v:.2f}" for v in df_g['% Realizado']], textposition='inside'))
-                        # AJUSTE: Cor do texto da meta (Preto)
-                        fig.add_hline(y=META_PCT, line_dash="dot", 
-                                      annotation_text=f"Meta: {META_PCT}%", 
-                                      annotation_position="top right",
-                                      annotation_font_color="black")
-                        fig.update_layout(title=f"{grupo}: % ", template=TEMPLATE_GRAFICO)
-                        st.plotly_chart(fig, use_container_width=True)
-
-            st.markdown("---")
-            st.subheader("📊 Performance por Equipe em M²")
-            if 'mes_ano' in df_p_agg.columns:
-                cols_t = st.columns(len(grupos_unicos))
                 for idx, grupo in enumerate(grupos_unicos):
-                    with cols_t[idx]:
-                        fig_t = criar_grafico_evolucao_com_geral(df_prod.rename(columns={col_equipe_p: 'Equipe'}), df_ret_filtrado.rename(columns={col_equipe_r: 'Equipe'}), grupo, META_PCT)
-                        if fig_t: st.plotly_chart(fig_t, use_container_width=True)
+                    with cols_g[idx]:
+                        df_g = tabela_por_grupo.get(grupo)
+                        if df_g is not None:
+                            st.plotly_chart(criar_grafico_pct_grupo(df_g, grupo, META_PCT), width='stretch')
+
+                st.markdown("---")
+                st.subheader("📊 Performance por Equipe em M²")
+                if evolucao_por_grupo:
+                    cols_t = st.columns(len(grupos_unicos))
+                    for idx, grupo in enumerate(grupos_unicos):
+                        with cols_t[idx]:
+                            fig_t = criar_grafico_evolucao_com_geral(evolucao_por_grupo.get(grupo), grupo, META_PCT)
+                            if fig_t: st.plotly_chart(fig_t, width='stretch')
             
-            st.markdown("---")
-            fig_tabela = criar_tabela_grafica(df_tabela_final, META_PCT)
-            if fig_tabela: st.plotly_chart(fig_tabela, use_container_width=True)
-
-            st.markdown("---")
-            st.subheader("🏆 Top Causas de Retenção")
-            cols_top = st.columns(len(grupos_unicos))
-            for idx, grupo in enumerate(grupos_unicos):
-                with cols_top[idx]:
-                    df_m = df_ret_filtrado[df_ret_filtrado['Grupo_Relatorio'] == grupo]
-                    if not df_m.empty:
-                        top = df_m.groupby('Motivo_Analise')['m2_real'].sum().sort_values(ascending=False).head(10).reset_index()
-                        fig_top = px.bar(top, y='Motivo_Analise', x='m2_real', orientation='h', title=f"Top 10 - {grupo}", text_auto='.2f', template=TEMPLATE_GRAFICO)
-                        st.plotly_chart(fig_top, use_container_width=True)
+                st.markdown("---")
+                # Só a página escolhida da tabela vai para o navegador
+                paginas = graficos.paginas_tabela(df_tabela_final)
+                pagina = st.number_input(f"Página da tabela (de {paginas})", min_value=1, max_value=paginas, value=1,
+                                         key='pagina_tabela') - 1 if paginas > 1 else 0
+                fig_tabela = criar_tabela_grafica(df_tabela_final, META_PCT, pagina, graficos.LINHAS_POR_PAGINA)
+                if fig_tabela: st.plotly_chart(fig_tabela, width='stretch')
+
+                st.markdown("---")
+                st.subheader("🏆 Top Causas de Retenção")
+                cols_top = st.columns(len(grupos_unicos))
+                for idx, grupo in enumerate(grupos_unicos):
+                    with cols_top[idx]:
+                        top = top_por_grupo.get(grupo)
+                        if top is not None:
+                            st.plotly_chart(criar_grafico_top_causas(top, grupo), width='stretch')
         
-        # --- AUDITORIA E DADOS DE CONFIGURAÇÃO (ABAIXO DO TOP 10) ---
-        st.markdown("---")
-        st.subheader("📝 Resumo das Configurações Aplicadas")
+            # --- AUDITORIA E DADOS DE CONFIGURAÇÃO (ABAIXO DO TOP 10) ---
+            st.markdown("---")
+            st.subheader("📝 Resumo das Configurações Aplicadas")
         
-        c_log1, c_log2, c_log3 = st.columns(3)
-        with c_log1:
-            st.markdown("**⛔ Motivos Excluídos:**")
-            if motivos_excluir:
-                for m in motivos_excluir: st.markdown(f"- {m}")
-            else: st.caption("Nenhum motivo excluído.")
+            c_log1, c_log2, c_log3 = st.columns(3)
+            with c_log1:
+                st.markdown("**⛔ Motivos Excluídos:**")
+                if motivos_excluir:
+                    for m in motivos_excluir: st.markdown(f"- {m}")
+                else: st.caption("Nenhum motivo excluído.")
         
-        with c_log2:
-            st.markdown("**📦 Agrupamento de Defeitos:**")
-            if st.session_state.grupos_motivos:
-                for g, l in st.session_state.grupos_motivos.items():
-                    st.markdown(f"**{g}** contém: " + ", ".join(l))
-            else: st.caption("Nenhum agrupamento de defeitos.")
+            with c_log2:
+                st.markdown("**📦 Agrupamento de Defeitos:**")
+                if st.session_state.grupos_motivos:
+                    for g, l in st.session_state.grupos_motivos.items():
+                        st.markdown(f"**{g}** contém: " + ", ".join(l))
+                else: st.caption("Nenhum agrupamento de defeitos.")
             
-        with c_log3:
-            st.markdown("**🏭 Agrupamento de Linhas:**")
-            if st.session_state.grupos_linhas:
-                for g, l in st.session_state.grupos_linhas.items():
-                    st.markdown(f"**Relatório {g}** contém: " + ", ".join(l))
-            else: st.caption("Cada linha é um relatório individual.")
+            with c_log3:
+                st.markdown("**🏭 Agrupamento de Linhas:**")
+                if st.session_state.grupos_linhas:
+                    for g, l in st.session_state.grupos_linhas.items():
+                        st.markdown(f"**Relatório {g}** contém: " + ", ".join(l))
+                else: st.caption("Cada linha é um relatório individual.")
 
     with tab2:
-        if motivo_alvo and motivo_alvo != "(Selecione um motivo)":
-            st.subheader(f"🔎 Análise: {motivo_alvo}")
-            df_spec = df_ret[df_ret[col_motivo] == motivo_alvo].copy()
-            todas_equipes = pd.DataFrame({'Equipe': sorted(df_prod[col_equipe_p].unique())})
-            
-            spec_agg = df_spec.groupby(col_equipe_r)['m2_real'].sum().reset_index().rename(columns={col_equipe_r: 'Equipe', 'm2_real': 'M2_Retido'})
-            spec_count = df_spec.groupby(col_equipe_r).size().reset_index(name='Qtd_Ocorrencias')
-            spec_final = pd.merge(todas_equipes, spec_agg, on='Equipe', how='left').fillna(0)
-            spec_final = pd.merge(spec_final, spec_count, on='Equipe', how='left').fillna(0)
+        if aba_aberta(tab2):
+            if motivo_alvo and motivo_alvo != "(Selecione um motivo)":
+                st.subheader(f"🔎 Análise: {motivo_alvo}")
+                with diag.etapa('analise_motivo', consultas.linhas):
+                    todas_equipes = pd.DataFrame({'Equipe': sorted(cubo_prod.index.get_level_values('Equipe').dropna().unique())})
+                    spec_final = pd.merge(todas_equipes, consultas.retidos_por_equipe(motivo_alvo), on='Equipe', how='left').fillna(0)
             
-            c1, c2 = st.columns(2)
-            with c1:
-                spec_final['Cor_M2'] = spec_final['M2_Retido'].apply(lambda x: '#27AE60' if x <= META_ABSOLUTA_M2 or not USAR_META_M2 else '#E74C3C')
-                fig = go.Figure(go.Bar(x=spec_final['Equipe'], y=spec_final['M2_Retido'], marker_color=spec_final['Cor_M2'], text=[f"{v:.2f}" for v in spec_final['M2_Retido']], textposition='auto'))
-                if USAR_META_M2: 
-                    # AJUSTE: Cor do texto da meta (Preto)
-                    fig.add_hline(y=META_ABSOLUTA_M2, line_dash="dash", 
-                                  annotation_text=f"Meta: {META_ABSOLUTA_M2}m²", 
-                                  annotation_position="top right",
-                                  annotation_font_color="black")
-                fig.update_layout(title="Metragem por Equipe", template=TEMPLATE_GRAFICO)
-                st.plotly_chart(fig, use_container_width=True)
-            with c2:
-                spec_final['Cor_Qtd'] = spec_final['Qtd_Ocorrencias'].apply(lambda x: '#27AE60' if x <= META_FREQ_QTD or not USAR_META_FREQ else '#E74C3C')
-                fig = go.Figure(go.Bar(x=spec_final['Equipe'], y=spec_final['Qtd_Ocorrencias'], marker_color=spec_final['Cor_Qtd'], text=spec_final['Qtd_Ocorrencias'], textposition='auto'))
-                if USAR_META_FREQ: 
-                    # AJUSTE: Cor do texto da meta (Preto)
-                    fig.add_hline(y=META_FREQ_QTD, line_dash="dash", 
-                                  annotation_text=f"Meta: {META_FREQ_QTD}", 
-                                  annotation_position="top right",
-                                  annotation_font_color="black")
-                fig.update_layout(title="Quantidade de Ocorrências", template=TEMPLATE_GRAFICO)
-                st.plotly_chart(fig, use_container_width=True)
-
-            spec_linha = df_spec.groupby('Grupo_Relatorio').size().reset_index(name='Qtd_Ocorrencias')
-            fig_l = px.bar(spec_linha, x='Grupo_Relatorio', y='Qtd_Ocorrencias', text='Qtd_Ocorrencias', title="Ocorrências por Grupo/Linha", template=TEMPLATE_GRAFICO)
-            st.plotly_chart(fig_l, use_container_width=True)
-        else:
-            st.info("👈 Selecione um motivo na barra lateral.")
+                c1, c2 = st.columns(2)
+                with c1:
+                    spec_final['Cor_M2'] = spec_final['M2_Retido'].apply(lambda x: '#27AE60' if x <= META_ABSOLUTA_M2 or not USAR_META_M2 else '#E74C3C')
+                    fig = go.Figure(go.Bar(x=spec_final['Equipe'], y=spec_final['M2_Retido'], marker_color=spec_final['Cor_M2'], text=[f"{v:.2f}" for v in spec_final['M2_Retido']], textposition='auto'))
+                    if USAR_META_M2: 
+                        # AJUSTE: Cor do texto da meta (Preto)
+                        fig.add_hline(y=META_ABSOLUTA_M2, line_dash="dash", 
+                                      annotation_text=f"Meta: {META_ABSOLUTA_M2}m²", 
+                                      annotation_position="top right",
+                                      annotation_font_color="black")
+                    fig.update_layout(title="Metragem por Equipe", template=TEMPLATE_GRAFICO)
+                    st.plotly_chart(fig, width='stretch')
+                with c2:
+                    spec_final['Cor_Qtd'] = spec_final['Qtd_Ocorrencias'].apply(lambda x: '#27AE60' if x <= META_FREQ_QTD or not USAR_META_FREQ else '#E74C3C')
+                    fig = go.Figure(go.Bar(x=spec_final['Equipe'], y=spec_final['Qtd_Ocorrencias'], marker_color=spec_final['Cor_Qtd'], text=spec_final['Qtd_Ocorrencias'], textposition='auto'))
+                    if USAR_META_FREQ: 
+                        # AJUSTE: Cor do texto da meta (Preto)
+                        fig.add_hline(y=META_FREQ_QTD, line_dash="dash", 
+                                      annotation_text=f"Meta: {META_FREQ_QTD}", 
+                                      annotation_position="top right",
+                                      annotation_font_color="black")
+                    fig.update_layout(title="Quantidade de Ocorrências", template=TEMPLATE_GRAFICO)
+                    st.plotly_chart(fig, width='stretch')
+
+                spec_linha = consultas.ocorrencias_por_grupo(motivo_alvo)
+                fig_l = px.bar(spec_linha, x='Grupo_Relatorio', y='Qtd_Ocorrencias', text='Qtd_Ocorrencias', title="Ocorrências por Grupo/Linha", template=TEMPLATE_GRAFICO)
+                st.plotly_chart(fig_l, width='stretch')
+
+                st.markdown("---")
+                st.subheader("🗓️ Detalhamento por Linha e Dia")
+                intervalo = consultas.intervalo_dias(motivo_alvo)
+                if pd.isna(intervalo['inicio']): st.caption("Este motivo não tem datas válidas.")
+                else:
+                    periodo = st.date_input("Período", (intervalo['inicio'], intervalo['fim']), min_value=intervalo['inicio'],
+                                            max_value=intervalo['fim'], format="DD/MM/YYYY", key=f"periodo_detalhe_{motivo_alvo}")
+                    if len(periodo) == 2:  # durante a seleção do intervalo só a data inicial está marcada
+                        with diag.etapa('detalhamento_motivo') as etapa:
+                            detalhe = consultas.detalhar_motivo(motivo_alvo, *periodo)
+                            etapa['linhas'] = len(detalhe)
+                        fig_d = criar_mapa_calor_motivo(detalhe, motivo_alvo)
+                        if fig_d: st.plotly_chart(fig_d, width='stretch')
+                        st.caption(f"Consultas servidas por {consultas.motor.upper()} ({consultas.linhas} somas parciais).")
+            else:
+                st.info("👈 Selecione um motivo na barra lateral.")
 
     with tab3:
-        st.dataframe(df_tabela_final, use_container_width=True)
-        st.download_button("📥 Baixar Excel", data=convert_df_to_excel(df_tabela_final), file_name="relatorio_consolidado.xlsx")
+        if aba_aberta(tab3):
+            st.dataframe(df_tabela_final, width='stretch')
+            # O Excel só é gerado quando o download é pedido
+            config_aplicada = {
+                'meta_pct': META_PCT,
+                'motivos_excluir': motivos_excluir,
+                'grupos_motivos': st.session_state.grupos_motivos,
+                'grupos_linhas': st.session_state.grupos_linhas,
+                'mapa_fornos': mapa_de_para_linhas,
+                'perfil': "{} (v{})".format(*st.session_state.perfil_ativo) if st.session_state.perfil_ativo else None,
+            }
+            exportar = diag.envolver('exportacao_excel', exportar_relatorio, adiada=True)
+            st.download_button("📥 Baixar Excel", data=partial(exportar, df_tabela_final, cubo_prod, cubo_ret_filtrado, config_aplicada),
+                               file_name="relatorio_consolidado.xlsx")
+
+    with tab4:
+        if aba_aberta(tab4):
+            frequencia = st.radio("Período", ['D', 'W'], format_func={'D': "Diário", 'W': "Semanal"}.get, horizontal=True)
+            # O resultado da execução anterior fica na sessão: só os períodos novos/alterados são recalculados
+            if 'tendencias' not in st.session_state: st.session_state.tendencias = {}
+            with diag.etapa('tendencias', len(df_prod) + len(df_ret)) as etapa:
+                serie = montar_serie_periodica(df_prod, df_ret, frequencia, motivos_excluir)
+                tendencias = calcular_tendencias(serie, frequencia, st.session_state.tendencias.get(frequencia))
+                st.session_state.tendencias[frequencia] = tendencias
+                etapa['linhas'] = len(serie)
+
+            if tendencias.empty: st.info("Sem datas válidas para montar as tendências.")
+            else:
+                st.caption("Gráfico p' (Laney): limites de 3σ calculados só com os períodos anteriores de cada Grupo/Equipe; "
+                           f"média móvel de {JANELA_MOVEL[frequencia]} períodos.")
+                c1, c2 = st.columns(2)
+                grupo_cep = c1.selectbox("Grupo", sorted(tendencias['Grupo_Relatorio'].unique()), key='grupo_cep')
+                df_grupo = tendencias[tendencias['Grupo_Relatorio'] == grupo_cep]
+                equipes_cep = sorted(df_grupo['Equipe'].unique(), key=lambda e: (e != 'Média Geral', e))
+                equipe_cep = c2.selectbox("Equipe", equipes_cep, key='equipe_cep')
+                fig_cep = criar_grafico_controle(df_grupo[df_grupo['Equipe'] == equipe_cep], f"{grupo_cep} - {equipe_cep}")
+                if fig_cep: st.plotly_chart(fig_cep, width='stretch')
+
+                st.subheader("🚨 Sinais Fora de Controle")
+                sinais = tendencias[tendencias['Fora_Controle']].sort_values('periodo', ascending=False)
+                if sinais.empty: st.caption("Nenhum período fora dos limites de controle.")
+                else:
+                    st.dataframe(sinais[['periodo', 'Grupo_Relatorio', 'Equipe', 'M2_Produzido', 'M2_Retido', 'Taxa', 'LCI', 'LCS']],
+                                 hide_index=True, width='stretch',
+                                 column_config={'periodo': st.column_config.DateColumn("Período", format="DD/MM/YYYY"),
+                                                **{c: st.column_config.NumberColumn(format="%.3f") for c in ['Taxa', 'LCI', 'LCS']}})
 
 else:
-    st.info("Aguardando upload dos arquivos (Formatos aceitos: .xlsx, .csv). O nome do arquivo não importa.")
\ No newline at end of file
+    st.info("Aguardando upload dos arquivos (Formatos aceitos: .xlsx, .csv). O nome do arquivo não importa.")
+
+# --- PAINEL DE DIAGNÓSTICO (preenchido por último, com as etapas desta execução) ---
+if diag.ativo:
+    with painel_diagnostico:
+        st.dataframe(diag.resumo(), hide_index=True, width='stretch',
+                     column_config={'segundos': st.column_config.NumberColumn(format="%.3f"),
+                                    'pico_mb': st.column_config.NumberColumn("pico (MB)", format="%.1f")})
+        st.caption("A memória é medida no processo inteiro do servidor: o pico inclui o que outras sessões alocaram "
+                   "no mesmo intervalo. Pico vazio = outra sessão estava medindo, só o tempo foi registrado.")
+        if diag.adiados:
+            ultima = diag.adiados[-1]
+            pico = "pico não medido" if ultima['pico_mb'] is None else f"pico de {ultima['pico_mb']:.1f} MB"
+            st.caption(f"Última exportação: {ultima['segundos']:.3f}s, {ultima['linhas']} linhas, {pico}")
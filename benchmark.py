@@ -0,0 +1,215 @@
+# Benchmark do pipeline de retidos sobre dados sintéticos:
+#   python benchmark.py --linhas 10000 100000 1000000 --formatos csv xlsx --formato-numero br us --saida resultados.json
+# Gera arquivos de produção/retidos com números no formato brasileiro (1.234,56, CSV com ';') ou americano
+# (1,234.56, CSV com ','), datas dd/mm/aaaa (células de data no xlsx), cronometra cada etapa separadamente
+# e grava os tempos em JSON (uma entrada por formato × números × tamanho × etapa)
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import platform
+import numpy as np
+import pandas as pd
+
+import graficos
+from calculos import (
+    TIPOS_ARQUIVO, VALOR_PARCIAL, ler_csv_em_blocos, ler_planilha_em_bloco, limpar_numero_coluna,
+    converter_datas, tratar_retidos, agregar_parcial, ler_e_agregar, aplicar_grupos_linhas,
+    aplicar_grupos_motivos, montar_cubo, calcular_kpis, adicionar_linhas_gerais, montar_evolucao, top_causas_por_grupo,
+)
+from exportacao import planilhas_relatorio, exportar_excel
+
+# --- DADOS SINTÉTICOS ---
+MOTIVOS_PADRAO = ['Trinca', 'Bolha', 'Mancha', 'Empeno', 'Lascado', 'Tonalidade', 'Calibre', 'Esmalte', 'Furo', 'Quebra']
+
+# Formato dos números gerados: (separador de milhar, separador decimal, separador do CSV)
+FORMATOS_NUMERO = {'br': ('.', ',', ';'), 'us': (',', '.', ',')}
+
+def formatar_numeros(valores, formato_numero='br'):
+    # 1234.5 -> '1.234,50' (br) ou '1,234.50' (us)
+    milhar, decimal, _ = FORMATOS_NUMERO[formato_numero]
+    return [f"{v:,.2f}".replace(',', 'X').replace('.', decimal).replace('X', milhar) for v in valores]
+
+def total_esperado(valores, formato_numero='br'):
+    # Soma dos valores gerados lidos de volta pelo formato conhecido (as células inválidas ficam de fora)
+    milhar, decimal, _ = FORMATOS_NUMERO[formato_numero]
+    texto = pd.Series(valores, dtype=str).str.replace(milhar, '', regex=False).str.replace(decimal, '.', regex=False)
+    return float(pd.to_numeric(texto, errors='coerce').sum())
+
+def gerar_dados(linhas, fornos=6, equipes=4, motivos=10, meses=6, sujeira=0.001, semente=0, formato_numero='br'):
+    # Produção e retidos com a mesma distribuição de datas/fornos/equipes; uma fração 'sujeira' das células
+    # de metragem e de data vem inválida, para exercitar os caminhos de erro
+    rng = np.random.default_rng(semente)
+    datas = pd.date_range('2025-01-01', periods=meses * 30, freq='D').strftime('%d/%m/%Y').to_numpy()
+    nomes_fornos = np.array([f"F{i + 1}" for i in range(fornos)])
+    nomes_equipes = np.array([chr(ord('A') + i) for i in range(equipes)])
+    nomes_motivos = np.array((MOTIVOS_PADRAO + [f"Motivo {i}" for i in range(len(MOTIVOS_PADRAO), motivos)])[:motivos])
+
+    def sujar(valores, invalido):
+        valores = np.asarray(valores, dtype=object)
+        valores[rng.random(len(valores)) < sujeira] = invalido
+        return valores
+
+    df_prod = pd.DataFrame({
+        'Data': sujar(rng.choice(datas, linhas), '31/02/2025'),
+        'Equipe': rng.choice(nomes_equipes, linhas),
+        'Forno': rng.choice(nomes_fornos, linhas),
+        'Metragem': sujar(formatar_numeros(rng.uniform(100, 5000, linhas), formato_numero), 'n/d'),
+    })
+    df_ret = pd.DataFrame({
+        'Data': sujar(rng.choice(datas, linhas), '31/02/2025'),
+        'Equipe': rng.choice(nomes_equipes, linhas),
+        'Forno': rng.choice(nomes_fornos, linhas),
+        'Motivo': rng.choice(nomes_motivos, linhas),
+        'M2': sujar(formatar_numeros(rng.uniform(1, 50, linhas), formato_numero), 'n/d'),
+    })
+    return df_prod, df_ret
+
+def gravar_dados(df, caminho, formato_numero='br'):
+    # CSV com o separador do formato dos números; xlsx linha a linha pelo exportador do relatório (o to_excel
+    # do pandas grava coluna a coluna, o que o modo de memória constante do xlsxwriter descarta), com as datas
+    # válidas como células de data do Excel e as inválidas como texto, como numa planilha digitada
+    if caminho.endswith('.csv'): df.to_csv(caminho, sep=FORMATOS_NUMERO[formato_numero][2], index=False)
+    else:
+        datas = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce')
+        exportar_excel({'Dados': df.assign(Data=datas.astype(object).where(datas.notna(), df['Data']))}, destino=caminho)
+
+def conferir_dados(caminho, tipo, linhas, total=None):
+    # Relê o arquivo e exige 'linhas' células preenchidas em cada coluna: um arquivo truncado mediria o vazio.
+    # Com o total gerado, confere também a soma ingerida (pega números lidos no formato errado)
+    mapa_colunas = TIPOS_ARQUIVO[tipo][0]
+    df = ler_arquivo(caminho, mapa_colunas)
+    preenchidas = df.notna().sum().to_dict() if df is not None else {}
+    if len(preenchidas) < len(mapa_colunas) or any(n != linhas for n in preenchidas.values()):
+        raise ValueError(f"{caminho}: esperadas {linhas} linhas em cada coluna, encontradas {preenchidas}")
+    if total is not None:
+        ingerido = float(agregar_arquivo(caminho, tipo)[VALOR_PARCIAL[tipo]].astype(float).sum())
+        if not np.isclose(ingerido, total, rtol=1e-9, atol=0.01):
+            raise ValueError(f"{caminho}: soma ingerida {ingerido:.2f}, gerada {total:.2f}")
+
+# --- CRONÔMETRO ---
+class Cronometro:
+    def __init__(self, repeticoes):
+        self.repeticoes = repeticoes
+        self.resultados = []
+
+    def medir(self, rotulos, etapa, funcao):
+        # Melhor tempo entre as repetições (menos ruído do sistema); devolve o resultado da última execução
+        tempos = []
+        for _ in range(self.repeticoes):
+            inicio = time.perf_counter()
+            resultado = funcao()
+            tempos.append(time.perf_counter() - inicio)
+        self.resultados.append(dict(rotulos, etapa=etapa, segundos=min(tempos), tempos=tempos))
+        print(f"  {etapa:<22} {min(tempos):8.3f}s", file=sys.stderr)
+        return resultado
+
+def ler_arquivo(caminho, mapa_colunas):
+    with open(caminho, 'rb') as arquivo:
+        if caminho.endswith('.csv'): return pd.concat(list(ler_csv_em_blocos(arquivo, mapa_colunas)), ignore_index=True)
+        return next(ler_planilha_em_bloco(arquivo, mapa_colunas), None)
+
+def agregar_arquivo(caminho, tipo):
+    with open(caminho, 'rb') as arquivo: return ler_e_agregar(arquivo, tipo)
+
+def medir_tamanho(cronometro, pasta, formato, formato_numero, linhas, args):
+    rotulos = {'formato': formato, 'numeros': formato_numero, 'linhas': linhas}
+    print(f"{formato} ({formato_numero}) × {linhas} linhas", file=sys.stderr)
+    arq_prod = os.path.join(pasta, f"producao_{formato_numero}_{linhas}.{formato}")
+    arq_ret = os.path.join(pasta, f"retidos_{formato_numero}_{linhas}.{formato}")
+    totais = {'producao': None, 'retidos': None}
+    if not (os.path.exists(arq_prod) and os.path.exists(arq_ret)):
+        df_prod, df_ret = gerar_dados(linhas, args.fornos, args.equipes, args.motivos, args.meses, args.sujeira,
+                                      formato_numero=formato_numero)
+        gravar_dados(df_prod, arq_prod, formato_numero)
+        gravar_dados(df_ret, arq_ret, formato_numero)
+        totais = {'producao': total_esperado(df_prod['Metragem'], formato_numero), 'retidos': total_esperado(df_ret['M2'], formato_numero)}
+        del df_prod, df_ret
+    # Também confere arquivos reaproveitados de --dados (podem ter sido gravados por outra versão; sem o total)
+    conferir_dados(arq_prod, 'producao', linhas, totais['producao'])
+    conferir_dados(arq_ret, 'retidos', linhas, totais['retidos'])
+
+    # Etapas isoladas sobre o arquivo de retidos (o maior em colunas)
+    bruto = cronometro.medir(rotulos, 'carregar_arquivo', lambda: ler_arquivo(arq_ret, TIPOS_ARQUIVO['retidos'][0]))
+    cronometro.medir(rotulos, 'limpar_numero', lambda b=bruto: limpar_numero_coluna(b['M2']))
+    cronometro.medir(rotulos, 'datas', lambda b=bruto: converter_datas(b['Data']))
+    df_norm = cronometro.medir(rotulos, 'normalizacao', lambda b=bruto: tratar_retidos(b))
+    cronometro.medir(rotulos, 'agregacao', lambda d=df_norm: agregar_parcial(d, 'retidos'))
+    del bruto, df_norm
+
+    # Ingestão completa como o dashboard faz (leitura em blocos + redução), seguida do restante do relatório
+    parcial_prod = cronometro.medir(rotulos, 'ingestao_producao', lambda: agregar_arquivo(arq_prod, 'producao'))
+    parcial_ret = cronometro.medir(rotulos, 'ingestao_retidos', lambda: agregar_arquivo(arq_ret, 'retidos'))
+
+    mapa_fornos = {f: f"Linha {f}" for f in parcial_prod['Forno'].dropna().unique()}
+    grupos_linhas = {'Grupo 1': list(mapa_fornos.values())[:2]}
+    grupos_motivos = {'Superfície': ['Mancha', 'Bolha', 'Esmalte']}
+    def mapear():
+        aplicar_grupos_linhas(parcial_prod, mapa_fornos, grupos_linhas)
+        aplicar_grupos_linhas(parcial_ret, mapa_fornos, grupos_linhas)
+        aplicar_grupos_motivos(parcial_ret, grupos_motivos)
+    cronometro.medir(rotulos, 'mapeamento', mapear)
+
+    meta_pct = 0.5
+    def calcular():
+        cubo_prod, cubo_ret = montar_cubo(parcial_prod, parcial_ret)
+        df_final = calcular_kpis(cubo_prod, cubo_ret, meta_pct)
+        return cubo_ret, adicionar_linhas_gerais(df_final, meta_pct), montar_evolucao(cubo_prod, cubo_ret)
+    cubo_ret, tabela, evolucao = cronometro.medir(rotulos, 'calculo', calcular)
+
+    def figuras():
+        tabela_por_grupo = dict(tuple(tabela.groupby('Grupo_Relatorio', sort=False, observed=True)))
+        evolucao_por_grupo = dict(tuple(evolucao.groupby('Grupo_Relatorio', sort=False, observed=True)))
+        top_por_grupo = top_causas_por_grupo(cubo_ret)
+        figs = [graficos.criar_tabela_grafica(tabela, meta_pct)]
+        for grupo, df_g in tabela_por_grupo.items():
+            figs.append(graficos.criar_grafico_pct_grupo(df_g, grupo, meta_pct))
+            figs.append(graficos.criar_grafico_evolucao_com_geral(evolucao_por_grupo.get(grupo), grupo, meta_pct))
+            if grupo in top_por_grupo: figs.append(graficos.criar_grafico_top_causas(top_por_grupo[grupo], grupo))
+        return figs
+    cronometro.medir(rotulos, 'figuras', figuras)
+
+    config = {'meta_pct': meta_pct, 'grupos_linhas': grupos_linhas, 'grupos_motivos': grupos_motivos, 'mapa_fornos': mapa_fornos}
+    cronometro.medir(rotulos, 'exportacao_excel', lambda: exportar_excel(planilhas_relatorio(tabela, evolucao, cubo_ret), config))
+
+# --- ENTRADA ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede o tempo de cada etapa do pipeline de retidos com dados sintéticos.")
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help="tamanhos (linhas por arquivo)")
+    parser.add_argument('--formatos', nargs='+', choices=['csv', 'xlsx'], default=['csv', 'xlsx'])
+    parser.add_argument('--formato-numero', nargs='+', choices=list(FORMATOS_NUMERO), default=['br'],
+                        help="números brasileiros (1.234,56) e/ou americanos (1,234.56)")
+    parser.add_argument('--fornos', type=int, default=6)
+    parser.add_argument('--equipes', type=int, default=4)
+    parser.add_argument('--motivos', type=int, default=10)
+    parser.add_argument('--meses', type=int, default=6)
+    parser.add_argument('--sujeira', type=float, default=0.001, help="fração de células de metragem/data inválidas")
+    parser.add_argument('--repeticoes', type=int, default=1, help="execuções por etapa (vale o menor tempo)")
+    parser.add_argument('--dados', help="pasta para guardar/reusar os arquivos gerados (padrão: temporária)")
+    parser.add_argument('--saida', help="arquivo JSON de resultados (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    cronometro = Cronometro(args.repeticoes)
+    with tempfile.TemporaryDirectory() as pasta_temp:
+        pasta = args.dados or pasta_temp
+        os.makedirs(pasta, exist_ok=True)
+        for formato in args.formatos:
+            for formato_numero in args.formato_numero:
+                for linhas in args.linhas:
+                    medir_tamanho(cronometro, pasta, formato, formato_numero, linhas, args)
+
+    resultado = {
+        'ambiente': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                     'maquina': platform.machine(), 'cpus': os.cpu_count()},
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('dados', 'saida')},
+        'resultados': cronometro.resultados,
+    }
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f: json.dump(resultado, f, indent=2, ensure_ascii=False)
+    else: json.dump(resultado, sys.stdout, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
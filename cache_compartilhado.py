@@ -0,0 +1,86 @@
+# Registro de conjuntos de dados compartilhado por todas as sessões do servidor (o dashboard o cria com st.cache_resource):
+# uma cópia de cada arquivo lido/normalizado por hash de conteúdo, com orçamento global de memória, descarte LRU e
+# contagem de referências por sessão. As sessões recebem o objeto compartilhado e devem tratá-lo como somente leitura
+import threading
+from collections import OrderedDict
+
+def tamanho_bytes(obj):
+    # DataFrames medem a própria memória; outros conjuntos (ex.: BaseConsultas) informam o tamanho em tamanho_bytes
+    if hasattr(obj, 'tamanho_bytes'): return obj.tamanho_bytes
+    return int(obj.memory_usage(deep=True).sum())
+
+class RegistroDatasets:
+    def __init__(self, orcamento_bytes, sessao_ativa=lambda sessao: True):
+        # sessao_ativa(sessao) -> bool: sessões encerradas soltam suas referências na próxima limpeza
+        self.orcamento_bytes = orcamento_bytes
+        self.sessao_ativa = sessao_ativa
+        self._itens = OrderedDict()  # chave -> {'df', 'bytes', 'sessoes'}; ordem = uso mais antigo primeiro
+        self._uso_por_sessao = {}    # sessao -> chaves em uso na última execução
+        self._carregando = {}        # chave -> trava: duas sessões com o mesmo arquivo leem uma vez só
+        self._trava = threading.Lock()
+        self.acertos = self.leituras = self.descartes = 0
+
+    def _pegar(self, chave, sessao):
+        item = self._itens.get(chave)
+        if item is None: return None
+        self._itens.move_to_end(chave)
+        self._referenciar(chave, sessao)
+        self.acertos += 1
+        return item
+
+    def _referenciar(self, chave, sessao):
+        self._itens[chave]['sessoes'].add(sessao)
+        self._uso_por_sessao.setdefault(sessao, set()).add(chave)
+
+    def obter(self, chave, carregar, sessao):
+        # Devolve (df, veio_do_cache). 'carregar' só roda se nenhuma sessão tiver lido a chave ainda
+        with self._trava:
+            item = self._pegar(chave, sessao)
+            if item is not None: return item['df'], True
+            trava_chave = self._carregando.setdefault(chave, threading.Lock())
+        with trava_chave:
+            with self._trava:
+                item = self._pegar(chave, sessao)  # outra sessão pode ter terminado a leitura enquanto esperávamos
+                if item is not None: return item['df'], True
+            df = carregar()
+            with self._trava:
+                self._carregando.pop(chave, None)
+                self.leituras += 1
+                if df is not None:
+                    self._itens[chave] = {'df': df, 'bytes': tamanho_bytes(df), 'sessoes': set()}
+                    self._referenciar(chave, sessao)
+                    self._liberar_espaco()
+        return df, False
+
+    def usar(self, sessao, chaves):
+        # As referências da sessão passam a ser exatamente as chaves usadas nesta execução
+        chaves = set(chaves)
+        with self._trava:
+            for chave in self._uso_por_sessao.get(sessao, set()) - chaves:
+                if chave in self._itens: self._itens[chave]['sessoes'].discard(sessao)
+            self._uso_por_sessao[sessao] = {c for c in chaves if c in self._itens}
+            for chave in self._uso_por_sessao[sessao]: self._itens[chave]['sessoes'].add(sessao)
+            self._liberar_espaco()
+
+    def _liberar_espaco(self):
+        # Chamado com a trava: solta as sessões encerradas e descarta, do uso mais antigo ao mais recente,
+        # os conjuntos sem referência até caber no orçamento (os em uso nunca são descartados)
+        for sessao in [s for s in self._uso_por_sessao if not self.sessao_ativa(s)]:
+            for chave in self._uso_por_sessao.pop(sessao):
+                if chave in self._itens: self._itens[chave]['sessoes'].discard(sessao)
+        total = sum(item['bytes'] for item in self._itens.values())
+        for chave in list(self._itens):
+            if total <= self.orcamento_bytes: break
+            if self._itens[chave]['sessoes']: continue
+            total -= self._itens.pop(chave)['bytes']
+            self.descartes += 1
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                'conjuntos': len(self._itens),
+                'bytes': sum(item['bytes'] for item in self._itens.values()),
+                'orcamento_bytes': self.orcamento_bytes,
+                'sessoes': len(self._uso_por_sessao),
+                'acertos': self.acertos, 'leituras': self.leituras, 'descartes': self.descartes,
+            }
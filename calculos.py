@@ -0,0 +1,511 @@
+# Cálculos do relatório de retidos, sem dependência do Streamlit:
+# usados pelo dashboard (GeradorRelatorio.py) e pela geração em lote (gerar_relatorios.py)
+import math
+import csv
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from diagnostico import sem_medicao
+
+# --- FUNÇÕES AUXILIARES ---
+def limpar_numero(val):
+    if pd.isna(val): return 0.0
+    if isinstance(val, (int, float)): return float(val)
+    val = str(val).strip().replace('R$', '').replace(' ', '')
+    val = val.replace('.', '').replace(',', '.')
+    try: return float(val)
+    except: return 0.0
+
+def detectar_decimal(serie):
+    # Separador decimal de uma coluna de números em texto: o que vem por último nos valores que têm os dois
+    # (1.234,56 ou 1,234.56); sem esses, ',' se algum valor tem vírgula. Só com ponto, '.' quando algum número
+    # não é um milhar brasileiro ('1234.5', '0.75'); '1.234' sozinho continua sendo milhar
+    unicos = pd.Series(serie.dropna().unique(), dtype=object)
+    texto = unicos[unicos.map(lambda v: isinstance(v, str))].astype(str).str.strip()
+    texto = texto.str.replace('R$', '', regex=False).str.replace(' ', '', regex=False)
+    virgula, ponto = texto.str.rfind(','), texto.str.rfind('.')
+    ambos = (virgula >= 0) & (ponto >= 0)
+    if ambos.any(): return '.' if (ponto[ambos] > virgula[ambos]).mean() > 0.5 else ','
+    if (virgula >= 0).any(): return ','
+    com_ponto = texto[texto.str.fullmatch(r'-?\d+\.\d+')]
+    return '.' if (~com_ponto.str.fullmatch(r'-?[1-9]\d{0,2}(\.\d{3})+')).any() else ','
+
+def limpar_numero_coluna(serie, decimal=','):
+    # Versão vetorizada de limpar_numero: devolve (valores float, qtd de células não numéricas)
+    # decimal='.' lê o texto no padrão americano (1,234.56), sem apagar o ponto decimal
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype(float).fillna(0.0), 0
+    # Converte cada valor distinto uma única vez (códigos repetidos são a regra nas planilhas)
+    codigos, unicos = pd.factorize(serie)
+    unicos = pd.Series(unicos, dtype=object)
+    eh_texto = unicos.map(lambda v: isinstance(v, str))
+    texto = (unicos[eh_texto].astype(str).str.strip()
+             .str.replace('R$', '', regex=False).str.replace(' ', '', regex=False))
+    if decimal == ',': texto = texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    else: texto = texto.str.replace(',', '', regex=False)
+    # O texto 'nan' (célula vazia exportada como texto) vale como vazio: 0.0 e não inválido. limpar_numero
+    # devolvia NaN, que as somas já ignoravam, então os totais são os mesmos
+    texto = texto.mask(texto.str.lower() == 'nan', '')
+    valores = pd.Series(np.nan, index=unicos.index)
+    valores[eh_texto] = pd.to_numeric(texto, errors='coerce')
+    # Booleanos (coluna só de True/False ou misturados ao texto) valem 1.0/0.0, como em limpar_numero
+    valores[~eh_texto] = pd.to_numeric(unicos[~eh_texto], errors='coerce').astype(float)
+    invalidos = pd.Series(False, index=unicos.index)
+    invalidos[eh_texto] = valores[eh_texto].isna() & (texto != '')
+    # O código -1 (vazio/NaN) aponta para o último elemento acrescentado: 0.0 e não inválido
+    valores_linha = np.append(valores.fillna(0.0).to_numpy(dtype=float), 0.0)[codigos]
+    qtd_invalidos = int(np.append(invalidos.to_numpy(), False)[codigos].sum())
+    return pd.Series(valores_linha, index=serie.index), qtd_invalidos
+
+def truncar_duas_casas(valor):
+    if pd.isna(valor) or valor == float('inf') or valor == float('-inf'):
+        return 0.0
+    # Multiplica por 100, corta as casas decimais (floor) e divide por 100
+    return math.floor(valor * 100) / 100
+
+def identificar_coluna(df, keywords, nome_padrao_exibicao):
+    colunas_df = [c.lower().strip() for c in df.columns]
+    mapa_cols = {c.lower().strip(): c for c in df.columns} 
+    for kw in keywords:
+        for col in colunas_df:
+            if kw in col:
+                return mapa_cols[col]
+    return None
+
+def carregar_arquivo(uploaded_file, colunas=None):
+    # colunas: filtro repassado ao usecols do pandas (None lê todas)
+    try:
+        if uploaded_file.name.lower().endswith('.csv'):
+            try: return pd.read_csv(uploaded_file, usecols=colunas)
+            except:
+                uploaded_file.seek(0)
+                return pd.read_csv(uploaded_file, sep=';', usecols=colunas)
+        else: return pd.read_excel(uploaded_file, usecols=colunas)
+    except Exception as e: return None
+
+# --- DATAS ---
+AMOSTRA_FORMATO_DATA = 20
+
+def converter_datas(serie):
+    # Cada data distinta é interpretada uma única vez. O formato é inferido uma vez, pela primeira das
+    # AMOSTRA_FORMATO_DATA datas distintas que o revele (dia primeiro; uma célula com lixo não estraga a coluna),
+    # e aplicado a todas; o mes_ano sai categórico, derivado só dos distintos.
+    # Retorna (datas por linha, mes_ano por linha, qtd de linhas preenchidas cuja data não foi reconhecida)
+    codigos, unicos = pd.factorize(serie)
+    datas_unicas = pd.Series(unicos)
+    if datas_unicas.dtype.kind != 'M':
+        amostra = [v for v in datas_unicas.dropna().head(AMOSTRA_FORMATO_DATA) if isinstance(v, str)]
+        formato = next(filter(None, (guess_datetime_format(v, dayfirst=True) for v in amostra)), None)
+        datas_unicas = pd.to_datetime(datas_unicas, format=formato, dayfirst=True, errors='coerce')
+
+    rotulos = datas_unicas.dt.strftime('%Y-%m')
+    meses = pd.Index(sorted(rotulos.dropna().unique()))
+    codigos_mes = np.append(meses.get_indexer(rotulos), -1)[codigos]  # código -1 (célula vazia) -> sem mês
+    mes_ano = pd.Series(pd.Categorical.from_codes(codigos_mes, categories=meses), index=serie.index)
+    datas = pd.Series(datas_unicas.array.take(codigos, allow_fill=True), index=serie.index)
+    datas_invalidas = int((datas.isna() & (codigos >= 0)).sum())
+    return datas, mes_ano, datas_invalidas
+
+# --- NORMALIZAÇÃO DOS ARQUIVOS ---
+LINHAS_POR_BLOCO = 200_000
+
+# Palavras-chave usadas para localizar cada coluna nos arquivos (a primeira que casar vence)
+COLUNAS_PRODUCAO = {
+    'Equipe': ['equipe', 'team', 'turno'], 'Forno': ['forno', 'linha', 'maq'],
+    'Metragem': ['metragem', 'm2', 'prod'], 'Data': ['data', 'date', 'dia'],
+}
+
+COLUNAS_RETIDOS = {
+    'Motivo': ['motivo', 'defeito', 'causa'], 'M2': ['m²', 'm2', 'metragem', 'quant'],
+    'Equipe': ['equipe', 'team', 'turno'], 'Forno': ['forno', 'linha', 'maq'],
+    'Data': ['data', 'date', 'dia', 'hora'],
+}
+
+def normalizar_dados(df, mapa_colunas, col_valor, nome_valor):
+    # Monta o quadro padronizado: só as colunas usadas, com nomes fixos e metragem já limpa
+    achadas = {nome: identificar_coluna(df, kws, nome) for nome, kws in mapa_colunas.items()}
+    df_norm = pd.DataFrame(index=df.index)
+    for nome in ['Motivo', 'Equipe', 'Forno']:
+        if achadas.get(nome):
+            serie = df[achadas[nome]]
+            # Colunas já categóricas (leitura em blocos) só têm as categorias convertidas
+            if isinstance(serie.dtype, pd.CategoricalDtype): df_norm[nome] = serie.cat.rename_categories(str)
+            else: df_norm[nome] = serie.where(serie.isna(), serie.astype(str)).astype('category')
+    # O separador decimal vem do primeiro bloco do arquivo (attrs 'decimal'), para valer igual em todos os blocos
+    qtd_invalidos, decimal = 0, df.attrs.get('decimal')
+    if achadas[col_valor]:
+        if decimal is None: decimal = detectar_decimal(df[achadas[col_valor]])
+        df_norm[nome_valor], qtd_invalidos = limpar_numero_coluna(df[achadas[col_valor]], decimal)
+    datas_invalidas = 0
+    if achadas['Data']:
+        df_norm['data_obj'], df_norm['mes_ano'], datas_invalidas = converter_datas(df[achadas['Data']])
+    else:
+        df_norm['data_obj'] = pd.NaT
+        df_norm['mes_ano'] = 'Sem Data'
+    df_norm.attrs['celulas_invalidas'] = qtd_invalidos
+    df_norm.attrs['decimal'] = decimal
+    df_norm.attrs['datas_invalidas'] = datas_invalidas
+    return df_norm
+
+def tratar_producao(df):
+    return normalizar_dados(df, COLUNAS_PRODUCAO, 'Metragem', 'metragem_real')
+
+def tratar_retidos(df):
+    return normalizar_dados(df, COLUNAS_RETIDOS, 'M2', 'm2_real')
+
+# --- AGREGAÇÃO INCREMENTAL (somas parciais por forno × equipe × dia) ---
+CHAVES_PARCIAIS = {
+    'producao': ['Forno', 'Equipe', 'mes_ano', 'dia'],
+    'retidos': ['Forno', 'Equipe', 'mes_ano', 'dia', 'Motivo'],
+}
+VALOR_PARCIAL = {'producao': 'metragem_real', 'retidos': 'm2_real'}
+TIPOS_ARQUIVO = {
+    'producao': (COLUNAS_PRODUCAO, tratar_producao),
+    'retidos': (COLUNAS_RETIDOS, tratar_retidos),
+}
+
+def agregar_parcial(df, tipo):
+    # Reduz as linhas a somas e contagens; linhas/grupos são aplicados depois, sobre este resumo
+    valor = VALOR_PARCIAL[tipo]
+    df = df.assign(dia=pd.to_datetime(df['data_obj']).dt.normalize())
+    chaves = [c for c in CHAVES_PARCIAIS[tipo] if c in df.columns]
+    if valor not in df.columns: return df[chaves].head(0)
+    return compactar_parcial(df.groupby(chaves, dropna=False, sort=False, observed=True)
+                               .agg(**{valor: (valor, 'sum'), 'qtd': (valor, 'size')}).reset_index(), tipo)
+
+def somar_parciais(parciais, tipo):
+    # Cada parcial volta a float64 antes do concat: um float32 juntado a um float64 viraria float64 sem
+    # o arredondamento para centavos
+    df = pd.concat([expandir_parcial(p, tipo) for p in parciais if p is not None], ignore_index=True)
+    chaves = [c for c in CHAVES_PARCIAIS[tipo] if c in df.columns]
+    valores = [c for c in [VALOR_PARCIAL[tipo], 'qtd'] if c in df.columns]
+    if not valores: return df[chaves].head(0)
+    # Blocos/arquivos com categorias diferentes voltam como texto no concat: a compactação os devolve a categóricos
+    return compactar_parcial(df.groupby(chaves, dropna=False, sort=False, observed=True)[valores].sum().reset_index(), tipo)
+
+# As somas parciais ficam guardadas (cache, sessão, histórico) com tipos compactos e só voltam a
+# float64/int64 na hora de somar, para que os totais saiam iguais aos calculados em float64
+COLUNAS_CATEGORICAS = ['Forno', 'Equipe', 'Motivo', 'mes_ano']
+
+def compactar_parcial(df, tipo):
+    # Texto -> categórico; contagem -> menor inteiro sem sinal que cabe; valor -> float32 quando todos os
+    # valores são centavos e o float32 os devolve intactos ao arredondar para 2 casas
+    valor = VALOR_PARCIAL[tipo]
+    tipos = {c: 'category' for c in COLUNAS_CATEGORICAS if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)}
+    if 'qtd' in df.columns and len(df): tipos['qtd'] = np.min_scalar_type(int(df['qtd'].max()))
+    if valor in df.columns and df[valor].dtype == np.float64:
+        valores = df[valor].to_numpy()
+        centavos = np.round(valores, 2)
+        if (np.allclose(valores, centavos, rtol=0, atol=1e-6, equal_nan=True)
+                and np.array_equal(np.round(valores.astype(np.float32).astype(np.float64), 2), centavos, equal_nan=True)):
+            tipos[valor] = np.float32
+    return df.astype(tipos)
+
+def expandir_parcial(df, tipo):
+    valor = VALOR_PARCIAL[tipo]
+    if valor in df.columns and df[valor].dtype == np.float32:
+        df = df.assign(**{valor: np.round(df[valor].to_numpy(dtype=np.float64), 2)})
+    if 'qtd' in df.columns: df = df.astype({'qtd': np.int64})
+    return df
+
+def parcial_vazio(tipo):
+    # Parcial sem linhas, com os mesmos tipos de um parcial lido (para fontes sem dados, ex.: mês só de um tipo)
+    colunas = {c: pd.Series(dtype='category') for c in CHAVES_PARCIAIS[tipo]}
+    colunas.update(dia=pd.Series(dtype='datetime64[us]'), **{VALOR_PARCIAL[tipo]: pd.Series(dtype=np.float64)},
+                   qtd=pd.Series(dtype=np.int64))
+    return pd.DataFrame(colunas)
+
+def linhas_substituidas(acumulado, novo):
+    # Linhas do acumulado cujo (Forno, dia) o novo arquivo também traz: reenviar a extração do dia não soma duas
+    # vezes, e um arquivo de um só forno não apaga os outros. Linhas sem data contam como um dia só (NaT casa com NaT)
+    chaves = [c for c in ['Forno', 'dia'] if c in acumulado.columns and c in novo.columns]
+    pares = pd.MultiIndex.from_frame(novo[chaves].drop_duplicates())
+    return pd.MultiIndex.from_frame(acumulado[chaves]).isin(pares)
+
+def incorporar_parcial(acumulado, novo, tipo):
+    if acumulado is None: return novo
+    return somar_parciais([acumulado[~linhas_substituidas(acumulado, novo)], novo], tipo)
+
+def consolidar_parciais(fontes, tipo, estado=None):
+    # estado = acumulado da sessão (modo incremental): só fontes ainda não vistas são incorporadas;
+    # 'linhas_substituidas' conta as linhas originais de fontes anteriores descartadas pela regra acima
+    if estado is None: estado = {'fontes': [], 'parcial': None}
+    for id_fonte, parcial in fontes:
+        if id_fonte in estado['fontes']: continue
+        if estado['parcial'] is not None:
+            substituidas = estado['parcial'].loc[linhas_substituidas(estado['parcial'], parcial), 'qtd']
+            estado['linhas_substituidas'] = estado.get('linhas_substituidas', 0) + int(substituidas.sum())
+        estado['parcial'] = incorporar_parcial(estado['parcial'], parcial, tipo)
+        estado['fontes'].append(id_fonte)
+    return estado['parcial']
+
+# --- LEITURA EM BLOCOS (CSV grandes) ---
+def colunas_usadas(colunas, mapa_colunas):
+    # Só as colunas que identificar_coluna escolhe pelo cabeçalho (uma por campo, na ordem do arquivo)
+    cabecalho = pd.DataFrame(columns=colunas)
+    escolhidas = {identificar_coluna(cabecalho, kws, nome) for nome, kws in mapa_colunas.items()}
+    return [c for c in colunas if c in escolhidas]
+
+LINHAS_AMOSTRA_CSV = 50
+
+def detectar_formato(arquivo, tamanho_amostra=65536):
+    # (separador, codificação) a partir do início do arquivo; exportações antigas do MES vêm em latin-1
+    amostra = arquivo.read(tamanho_amostra)
+    arquivo.seek(0)
+    try: texto, codificacao = amostra.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError: texto, codificacao = amostra.decode('latin-1'), 'latin-1'
+    # A amostra pode terminar no meio de uma linha: analisa só as linhas completas, no máximo LINHAS_AMOSTRA_CSV
+    # (as expressões do Sniffer ficam lentas em amostras grandes com campos entre aspas, como 1,234.56 num CSV com ',')
+    texto = '\n'.join(texto.split('\n')[:-1][:LINHAS_AMOSTRA_CSV]) if '\n' in texto else texto
+    try: return csv.Sniffer().sniff(texto, delimiters=',;\t|').delimiter, codificacao
+    except csv.Error:
+        cabecalho = texto.split('\n', 1)[0]
+        return (';' if cabecalho.count(';') > cabecalho.count(',') else ','), codificacao
+
+def ler_csv_em_blocos(arquivo, mapa_colunas):
+    # Lê só as colunas usadas, texto como categoria, em blocos de LINHAS_POR_BLOCO linhas
+    sep, codificacao = detectar_formato(arquivo)
+    cabecalho = pd.read_csv(arquivo, sep=sep, encoding=codificacao, nrows=0)
+    arquivo.seek(0)
+    usadas = colunas_usadas(cabecalho.columns, mapa_colunas)
+    textos = {identificar_coluna(cabecalho, mapa_colunas[nome], nome) for nome in ['Motivo', 'Equipe', 'Forno'] if nome in mapa_colunas}
+    dtypes = {c: ('category' if c in textos else str) for c in usadas}
+    return pd.read_csv(arquivo, sep=sep, encoding=codificacao, usecols=usadas, dtype=dtypes, chunksize=LINHAS_POR_BLOCO)
+
+def ler_planilha_em_bloco(arquivo, mapa_colunas):
+    # Planilhas não são lidas em partes: o arquivo inteiro é um bloco só (o cabeçalho é lido antes, para o usecols)
+    cabecalho = pd.read_excel(arquivo, nrows=0)
+    arquivo.seek(0)
+    df = carregar_arquivo(arquivo, colunas=colunas_usadas(cabecalho.columns, mapa_colunas))
+    if df is not None: yield df
+
+def ler_e_agregar(arquivo, tipo, medir=sem_medicao):
+    # Cada bloco é normalizado e reduzido às somas parciais na hora: a memória acompanha o bloco, não o arquivo.
+    # medir(nome, linhas): context manager de instrumentação (Diagnostico.etapa); por padrão não mede nada
+    mapa_colunas, tratar = TIPOS_ARQUIVO[tipo]
+    try:
+        if arquivo.name.lower().endswith('.csv'): blocos = ler_csv_em_blocos(arquivo, mapa_colunas)
+        else: blocos = ler_planilha_em_bloco(arquivo, mapa_colunas)
+        parcial, qtd_invalidos, datas_invalidas, decimal = None, 0, 0, None
+        while True:
+            with medir(f"leitura_{tipo}") as registro:
+                bloco = next(blocos, None)
+                registro['linhas'] = len(bloco) if bloco is not None else 0
+            if bloco is None: break
+            bloco.attrs['decimal'] = decimal
+            with medir(f"limpeza_{tipo}", len(bloco)):
+                df_norm = tratar(bloco)
+            decimal = df_norm.attrs['decimal']
+            qtd_invalidos += df_norm.attrs['celulas_invalidas']
+            datas_invalidas += df_norm.attrs['datas_invalidas']
+            with medir(f"agregacao_{tipo}", len(df_norm)):
+                parcial = somar_parciais([parcial, agregar_parcial(df_norm, tipo)], tipo)
+    except Exception as e: return None
+    if parcial is None: return None
+    parcial.attrs['celulas_invalidas'] = qtd_invalidos
+    parcial.attrs['datas_invalidas'] = datas_invalidas
+    return parcial
+
+# --- MAPEAMENTOS (forno → linha → grupo, motivo → grupo de defeito) ---
+def listar_fornos(df_prod, df_ret):
+    fornos_prod = df_prod['Forno'].dropna().unique().tolist()
+    fornos_ret = df_ret['Forno'].dropna().unique().tolist()
+    return sorted(list(set([str(x) for x in fornos_prod + fornos_ret])))
+
+def inverter_grupos(grupos):
+    # {grupo: [itens]} -> {item: grupo}; como no laço original, o primeiro grupo que contém o item vence
+    inverso = {}
+    for nome_grupo, itens in grupos.items():
+        for item in itens: inverso.setdefault(item, nome_grupo)
+    return inverso
+
+def mapear_categorias(serie, mapa, padrao=None, valor_nulo=None):
+    # Consulta o mapa uma vez por valor distinto e expande pelos códigos; o resultado é categórico
+    # padrao=None mantém os valores fora do mapa; valor_nulo substitui os vazios (NaN)
+    cat = serie.astype('category')
+    origem = cat.cat.categories
+    destino = [mapa.get(v, v if padrao is None else padrao) for v in origem]
+    if valor_nulo is not None: destino.append(valor_nulo)
+    codigos_destino, categorias = pd.factorize(pd.Series(destino, dtype=object), sort=True)
+    if valor_nulo is None: codigos_destino = np.append(codigos_destino, -1)
+    # O código -1 (vazio) aponta para o último elemento: o valor_nulo ou, sem ele, continua vazio
+    novos = codigos_destino[cat.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(novos, categories=categorias), index=serie.index)
+
+def aplicar_grupos_linhas(df, mapa_fornos, grupos_linhas):
+    # Mapas resolvidos por código distinto (categorias), não linha a linha
+    df['Linha_Nome'] = mapear_categorias(df['Forno'], mapa_fornos, padrao='Outros', valor_nulo='Outros')
+    df['Grupo_Relatorio'] = mapear_categorias(df['Linha_Nome'], inverter_grupos(grupos_linhas))
+    return df
+
+def aplicar_grupos_motivos(df_ret, grupos_motivos):
+    df_ret['Motivo_Analise'] = mapear_categorias(df_ret['Motivo'], inverter_grupos(grupos_motivos))
+    return df_ret
+
+# --- CÁLCULOS KPI ---
+def montar_cubo(df_prod, df_ret):
+    # Uma única passada sobre os dados: abas e gráficos leem fatias deste cubo em vez de filtrar grupo a grupo
+    df_prod, df_ret = expandir_parcial(df_prod, 'producao'), expandir_parcial(df_ret, 'retidos')
+    cubo_prod = df_prod.groupby(['Grupo_Relatorio', 'Equipe', 'mes_ano'], dropna=False, observed=True)[['metragem_real', 'qtd']].sum()
+    cubo_ret = df_ret.groupby(['Grupo_Relatorio', 'Equipe', 'mes_ano', 'Motivo', 'Motivo_Analise'], dropna=False, observed=True)[['m2_real', 'qtd']].sum()
+    return cubo_prod, cubo_ret
+
+def filtrar_motivos(cubo_ret, motivos_excluir):
+    if not motivos_excluir: return cubo_ret
+    return cubo_ret[~cubo_ret.index.get_level_values('Motivo').isin(motivos_excluir)]
+
+def calcular_kpis(cubo_prod, cubo_ret, meta_pct):
+    # Agrupa por Grupo_Relatorio e Equipe (Soma tudo o que estiver dentro do grupo)
+    prod_agg = cubo_prod.groupby(level=['Grupo_Relatorio', 'Equipe'], observed=True)['metragem_real'].sum().reset_index().rename(columns={'metragem_real': 'M2_Produzido'})
+    ret_agg = cubo_ret.groupby(level=['Grupo_Relatorio', 'Equipe'], observed=True)['m2_real'].sum().reset_index().rename(columns={'m2_real': 'M2_Retido'})
+    
+    df_final = pd.merge(prod_agg, ret_agg, on=['Grupo_Relatorio', 'Equipe'], how='outer').fillna(0)
+    
+    df_final['Meta_M2'] = df_final['M2_Produzido'] * (meta_pct / 100)
+    df_final['Saldo_M2'] = df_final['Meta_M2'] - df_final['M2_Retido']
+    # Calcula o percentual bruto e depois aplica o truncamento linha a linha
+    pct_raw = (df_final['M2_Retido'] / df_final['M2_Produzido']) * 100
+    df_final['% Realizado'] = pct_raw.apply(truncar_duas_casas)
+    return df_final
+
+def adicionar_linhas_gerais(df_original, meta_pct):
+    # Acrescenta a linha 'Média Geral' de todos os grupos de uma vez e ordena grupo a grupo
+    if df_original.empty: return pd.DataFrame()
+    gerais = df_original.groupby('Grupo_Relatorio', as_index=False, observed=True)[['M2_Produzido', 'M2_Retido']].sum()
+    gerais['Equipe'] = 'Média Geral'
+    gerais['Meta_M2'] = gerais['M2_Produzido'] * (meta_pct / 100)
+    gerais['Saldo_M2'] = gerais['Meta_M2'] - gerais['M2_Retido']
+    # Cálculo com truncamento (sem arredondar para cima)
+    pct_calc = (gerais['M2_Retido'] / gerais['M2_Produzido'] * 100).where(gerais['M2_Produzido'] > 0, 0)
+    gerais['% Realizado'] = pct_calc.apply(truncar_duas_casas)
+
+    df_final = pd.concat([df_original.assign(Equipe=df_original['Equipe'].astype(str)), gerais[df_original.columns]], ignore_index=True)
+    df_final['Ordem'] = (df_final['Equipe'] == 'Média Geral').astype(int)
+    df_final = df_final.sort_values(by=['Grupo_Relatorio', 'Ordem', 'Equipe'], kind='stable', ignore_index=True)
+    df_final['Status'] = np.where(df_final['% Realizado'] <= meta_pct, 'Dentro da Meta (Verde)', 'Fora da Meta (Vermelho)')
+    return df_final
+
+def montar_evolucao(cubo_prod, cubo_ret):
+    # Mês × Equipe, mais a linha 'Média Geral' de cada mês, para todos os grupos
+    p_eq = cubo_prod.groupby(level=['Grupo_Relatorio', 'mes_ano', 'Equipe'], observed=True)['metragem_real'].sum().reset_index()
+    r_eq = cubo_ret.groupby(level=['Grupo_Relatorio', 'mes_ano', 'Equipe'], observed=True)['m2_real'].sum().reset_index()
+    p_tot = cubo_prod.groupby(level=['Grupo_Relatorio', 'mes_ano'], observed=True)['metragem_real'].sum().reset_index().assign(Equipe='Média Geral')
+    r_tot = cubo_ret.groupby(level=['Grupo_Relatorio', 'mes_ano'], observed=True)['m2_real'].sum().reset_index().assign(Equipe='Média Geral')
+    df_evolucao = pd.merge(pd.concat([p_eq, p_tot]).rename(columns={'metragem_real': 'M2_Produzido'}),
+                           pd.concat([r_eq, r_tot]).rename(columns={'m2_real': 'M2_Retido'}),
+                           on=['Grupo_Relatorio', 'mes_ano', 'Equipe'], how='outer').fillna(0)
+    return df_evolucao
+
+def top_causas_por_grupo(cubo_ret, n=10):
+    top_causas = cubo_ret.groupby(level=['Grupo_Relatorio', 'Motivo_Analise'], observed=True)['m2_real'].sum().sort_values(ascending=False)
+    return dict(tuple(top_causas.groupby(level='Grupo_Relatorio', sort=False, observed=True).head(n).reset_index().groupby('Grupo_Relatorio', sort=False, observed=True)))
+
+# --- TENDÊNCIAS E CONTROLE ESTATÍSTICO (gráfico p' de Laney por Grupo × Equipe) ---
+# Taxa de retenção = m² retido / m² produzido, com o m² produzido como tamanho da amostra. Com amostras desse
+# tamanho o gráfico p clássico dá limites estreitos demais (quase todo dia "fora"); o p' de Laney os alarga pela
+# variação real entre períodos (amplitude móvel dos z). Linha central, sigma e amplitude média de cada período
+# vêm só dos períodos ANTERIORES do mesmo Grupo/Equipe: um período novo nunca altera os já calculados, então a
+# atualização só processa o que chegou
+JANELA_MOVEL = {'D': 7, 'W': 4}
+CHAVES_TENDENCIA = ['Grupo_Relatorio', 'Equipe']
+ACUMULADOS = ['acum_prod', 'acum_ret', 'acum_mr', 'n_mr']
+D2 = 1.128  # constante d2 da amplitude móvel de 2 pontos
+
+def montar_serie_periodica(df_prod, df_ret, frequencia='D', motivos_excluir=()):
+    # Grupo × Equipe × período (dia, ou semana iniciada na segunda), mais a 'Média Geral' de cada grupo
+    def somar(df, valor, nome):
+        df = expandir_parcial(df, 'producao' if valor == 'metragem_real' else 'retidos')
+        periodo = df['dia'] if frequencia == 'D' else df['dia'] - pd.to_timedelta(df['dia'].dt.weekday, unit='D')
+        df = df.assign(periodo=periodo.dt.normalize())
+        por_equipe = df.groupby(CHAVES_TENDENCIA + ['periodo'], observed=True)[valor].sum().reset_index()
+        geral = df.groupby(['Grupo_Relatorio', 'periodo'], observed=True)[valor].sum().reset_index().assign(Equipe='Média Geral')
+        return pd.concat([por_equipe, geral], ignore_index=True).astype({'Equipe': str}).rename(columns={valor: nome})
+    if motivos_excluir: df_ret = df_ret[~df_ret['Motivo'].isin(motivos_excluir)]
+    serie = pd.merge(somar(df_prod, 'metragem_real', 'M2_Produzido'), somar(df_ret, 'm2_real', 'M2_Retido'),
+                     on=CHAVES_TENDENCIA + ['periodo'], how='left').fillna({'M2_Retido': 0})
+    serie = serie[serie['M2_Produzido'] > 0].astype({'Grupo_Relatorio': str})
+    return serie.sort_values(CHAVES_TENDENCIA + ['periodo'], ignore_index=True)
+
+def _calcular_controle(novos, contexto, janela):
+    # novos: períodos a calcular; contexto: linhas já calculadas (fornecem a janela móvel e os acumulados)
+    ultimos = contexto.groupby(CHAVES_TENDENCIA, sort=False).tail(janela - 1)
+    base = contexto.groupby(CHAVES_TENDENCIA, sort=False)[ACUMULADOS].last().reset_index()
+    df = pd.concat([ultimos[list(novos.columns) + ['z']].assign(_contexto=True), novos.assign(_contexto=False)],
+                   ignore_index=True).sort_values(CHAVES_TENDENCIA + ['periodo'], ignore_index=True)
+
+    # Somas móveis das últimas 'janela' observações de cada Grupo/Equipe (razão das somas, não média das taxas)
+    moveis = (df.groupby(CHAVES_TENDENCIA, sort=False)[['M2_Produzido', 'M2_Retido']]
+                .rolling(janela, min_periods=1).sum().reset_index(level=CHAVES_TENDENCIA, drop=True))
+    df['Media_Movel'] = moveis['M2_Retido'] / moveis['M2_Produzido'] * 100
+
+    novo = ~df['_contexto']
+    deslocamento = df.loc[novo, CHAVES_TENDENCIA].merge(base, on=CHAVES_TENDENCIA, how='left').fillna(0)
+    def acumular(valores):
+        return deslocamento[valores.name].to_numpy() + valores.groupby([df.loc[novo, c] for c in CHAVES_TENDENCIA],
+                                                                        sort=False).cumsum().to_numpy()
+    prod, ret = df.loc[novo, 'M2_Produzido'], df.loc[novo, 'M2_Retido']
+    df.loc[novo, 'acum_prod'] = acumular(prod.rename('acum_prod'))
+    df.loc[novo, 'acum_ret'] = acumular(ret.rename('acum_ret'))
+
+    p = ret / prod
+    prod_anterior = df.loc[novo, 'acum_prod'] - prod
+    p_barra = ((df.loc[novo, 'acum_ret'] - ret) / prod_anterior).where(prod_anterior > 0)
+    sigma_p = np.sqrt(p_barra * (1 - p_barra) / prod)
+    df.loc[novo, 'z'] = (p - p_barra) / sigma_p
+
+    # Amplitude móvel dos z (o z anterior pode vir do contexto) e sua média acumulada até o período anterior
+    mr = (df['z'] - df.groupby(CHAVES_TENDENCIA, sort=False)['z'].shift()).abs()[novo]
+    df.loc[novo, 'acum_mr'] = acumular(mr.fillna(0).rename('acum_mr'))
+    df.loc[novo, 'n_mr'] = acumular(mr.notna().astype('int64').rename('n_mr'))
+    n_anterior = df.loc[novo, 'n_mr'] - mr.notna()
+    sigma_z = ((df.loc[novo, 'acum_mr'] - mr.fillna(0)) / n_anterior / D2).where(n_anterior >= 2)
+
+    df = df[novo].drop(columns='_contexto')
+    df['Taxa'] = p * 100
+    df['LC'] = p_barra * 100
+    df['LCS'] = (p_barra + 3 * sigma_p * sigma_z) * 100
+    df['LCI'] = (p_barra - 3 * sigma_p * sigma_z).clip(lower=0) * 100
+    df['Fora_Controle'] = (df['Taxa'] > df['LCS']) | (df['Taxa'] < df['LCI'])
+    return df
+
+def calcular_tendencias(serie, frequencia='D', anterior=None):
+    # Com 'anterior' (resultado da chamada passada), só recalcula a partir do primeiro período que mudou;
+    # períodos anteriores a ele são reaproveitados como estão
+    janela = JANELA_MOVEL[frequencia]
+    chaves = CHAVES_TENDENCIA + ['periodo']
+    if anterior is None or anterior.empty:
+        return _calcular_controle(serie, serie.head(0).assign(z=np.nan, **dict.fromkeys(ACUMULADOS, 0.0)), janela)
+
+    comparacao = serie.merge(anterior[chaves + ['M2_Produzido', 'M2_Retido']], on=chaves, how='outer',
+                             suffixes=('', '_ant'), indicator=True)
+    mudou = ((comparacao['_merge'] != 'both')
+             | ~np.isclose(comparacao['M2_Produzido'], comparacao['M2_Produzido_ant'])
+             | ~np.isclose(comparacao['M2_Retido'], comparacao['M2_Retido_ant']))
+    if not mudou.any(): return anterior
+    inicio = comparacao.loc[mudou, 'periodo'].min()
+    mantidos = anterior[anterior['periodo'] < inicio]
+    calculados = _calcular_controle(serie[serie['periodo'] >= inicio], mantidos, janela)
+    return pd.concat([mantidos, calculados], ignore_index=True).sort_values(chaves, ignore_index=True)
+
+def calcular_relatorio(df_prod, df_ret, config):
+    # Pipeline completo sobre as somas parciais, com a configuração num dicionário:
+    # mapa_fornos, grupos_linhas, grupos_motivos, motivos_excluir, meta_pct
+    meta_pct = config.get('meta_pct', 0.5)
+    mapa_fornos = {f: f for f in listar_fornos(df_prod, df_ret)}
+    mapa_fornos.update(config.get('mapa_fornos', {}))
+    aplicar_grupos_linhas(df_prod, mapa_fornos, config.get('grupos_linhas', {}))
+    aplicar_grupos_linhas(df_ret, mapa_fornos, config.get('grupos_linhas', {}))
+    aplicar_grupos_motivos(df_ret, config.get('grupos_motivos', {}))
+
+    cubo_prod, cubo_ret = montar_cubo(df_prod, df_ret)
+    cubo_ret_filtrado = filtrar_motivos(cubo_ret, config.get('motivos_excluir', []))
+    df_final = calcular_kpis(cubo_prod, cubo_ret_filtrado, meta_pct)
+    return {
+        'meta_pct': meta_pct,
+        'grupos': sorted(df_final['Grupo_Relatorio'].unique()),
+        'tabela_final': adicionar_linhas_gerais(df_final, meta_pct),
+        'evolucao': montar_evolucao(cubo_prod, cubo_ret_filtrado),
+        'top_causas': top_causas_por_grupo(cubo_ret_filtrado),
+        'cubo_ret': cubo_ret_filtrado,
+    }
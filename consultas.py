@@ -0,0 +1,158 @@
+# Motor de consultas local para os detalhamentos interativos (análise por motivo, Top 10, motivo × forno × dia):
+# DuckDB quando instalado (colunar, filtros empurrados para a varredura), senão SQLite em memória com índices.
+# Os fatos (somas parciais forno × equipe × dia × motivo) são carregados uma vez por conjunto de dados e
+# compartilhados por todas as sessões (BaseConsultas, guardada no registro compartilhado); cada sessão abre sua
+# própria conexão (ConsultasSessao) com os mapeamentos dela (forno → linha → grupo, motivo → grupo de defeito) em
+# tabelas temporárias pequenas, juntadas na consulta: editar grupos não recarrega nada nem afeta outras sessões
+import itertools
+import sqlite3
+import pandas as pd
+
+from calculos import expandir_parcial, aplicar_grupos_linhas, aplicar_grupos_motivos
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+COLUNAS_FATOS = ['Forno', 'Equipe', 'Motivo', 'dia', 'm2_real', 'qtd']
+# Índices de cobertura (SQLite): cada consulta lê só o índice, já ordenado pelas colunas filtradas
+INDICES = {
+    'retidos': [('Motivo', 'dia', 'Forno', 'm2_real', 'qtd')],
+    'resumo': [('Motivo', 'Forno', 'Equipe', 'm2_real', 'qtd')],
+}
+# Os mapeamentos aceitam forno/motivo vazio (NULL), que também tem linha e grupo: a junção compara NULL = NULL
+IGUAL_OU_NULO = {'duckdb': 'IS NOT DISTINCT FROM', 'sqlite': 'IS'}
+JUNCAO_DIMENSOES = """
+    JOIN fornos f ON r.Forno {igual} f.Forno
+    JOIN motivos m ON r.Motivo {igual} m.Motivo"""
+_numeracao_bases = itertools.count()
+
+def motor_padrao():
+    return 'duckdb' if duckdb is not None else 'sqlite'
+
+def _para_sql(df):
+    # Categorias viram texto simples e datas viram 'AAAA-MM-DD' (ordenável e igual nos dois motores)
+    df = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    if 'dia' in df: df['dia'] = df['dia'].dt.strftime('%Y-%m-%d')
+    return df
+
+class BaseConsultas:
+    def __init__(self, df_ret, motor=None):
+        # df_ret: parcial de retidos consolidado (com ou sem as colunas de mapeamento, que são ignoradas).
+        # Somente leitura depois de montada: as sessões só consultam, por conexões próprias (sessao())
+        self.motor = motor or motor_padrao()
+        if self.motor == 'duckdb': self._con = duckdb.connect()
+        else:
+            # Banco em memória com cache compartilhado: as conexões das sessões enxergam as mesmas tabelas
+            self._uri = f"file:consultas_{next(_numeracao_bases)}?mode=memory&cache=shared"
+            self._con = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+        fatos = _para_sql(expandir_parcial(df_ret, 'retidos')[COLUNAS_FATOS])
+        self._carregar_tabela('retidos', fatos)
+        # Resumo sem o dia: serve a análise por motivo e o Top 10 sem varrer os fatos
+        self._con.execute("""CREATE TABLE resumo AS
+            SELECT Motivo, Forno, Equipe, SUM(m2_real) AS m2_real, SUM(qtd) AS qtd
+            FROM retidos GROUP BY Motivo, Forno, Equipe""")
+        if self.motor == 'sqlite':
+            for tabela, indices in INDICES.items():
+                for i, colunas in enumerate(indices):
+                    self._con.execute(f"CREATE INDEX idx_{tabela}_{i} ON {tabela} ({', '.join(colunas)})")
+            self._con.commit()
+            # Tamanho real do banco (fatos, resumo e índices), usado no orçamento do registro compartilhado
+            self.tamanho_bytes = (self._con.execute("PRAGMA page_count").fetchone()[0]
+                                  * self._con.execute("PRAGMA page_size").fetchone()[0])
+        else: self.tamanho_bytes = int(fatos.memory_usage(deep=True).sum())
+        self.categorias_forno = df_ret['Forno'].astype('category').cat.categories
+        self.categorias_motivo = df_ret['Motivo'].astype('category').cat.categories
+        self.linhas = len(fatos)
+
+    def _carregar_tabela(self, nome, df):
+        if self.motor == 'duckdb':
+            self._con.register('_origem', df)
+            self._con.execute(f"CREATE OR REPLACE TABLE {nome} AS SELECT * FROM _origem")
+            self._con.unregister('_origem')
+        else: df.to_sql(nome, self._con, index=False, if_exists='replace')
+
+    def sessao(self):
+        return ConsultasSessao(self)
+
+class ConsultasSessao:
+    # Conexão de uma sessão com a base compartilhada: só os mapeamentos desta sessão são copiados
+    def __init__(self, base):
+        self.base, self.motor, self.linhas = base, base.motor, base.linhas
+        if self.motor == 'duckdb': self._con = base._con.cursor()
+        else: self._con = sqlite3.connect(base._uri, uri=True, check_same_thread=False)
+        self._assinatura_mapeamentos = None
+        self._juncao = JUNCAO_DIMENSOES.format(igual=IGUAL_OU_NULO[self.motor])
+
+    def _carregar_temporaria(self, nome, df):
+        # Tabelas temporárias são da conexão: outras sessões, com outros grupos, não as veem
+        if self.motor == 'duckdb':
+            self._con.register('_origem', df)
+            self._con.execute(f"CREATE OR REPLACE TEMP TABLE {nome} AS SELECT * FROM _origem")
+            self._con.unregister('_origem')
+        else:
+            self._con.execute(f"DROP TABLE IF EXISTS temp.{nome}")
+            self._con.execute(f"CREATE TEMP TABLE {nome} ({', '.join(df.columns)})")
+            linhas = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            self._con.executemany(f"INSERT INTO temp.{nome} VALUES ({', '.join('?' * len(df.columns))})", linhas)
+            self._con.commit()
+
+    def consultar(self, sql, parametros=()):
+        if self.motor == 'duckdb': df = self._con.execute(sql, list(parametros)).df()
+        else: df = pd.read_sql_query(sql, self._con, params=list(parametros))
+        if 'dia' in df: df['dia'] = pd.to_datetime(df['dia'])
+        return df
+
+    def mapear(self, mapa_fornos, grupos_linhas, grupos_motivos):
+        # Recarrega só as tabelas de mapeamento, e só quando mudaram; mesmas regras de aplicar_grupos_*
+        assinatura = repr((sorted(mapa_fornos.items()), grupos_linhas, grupos_motivos))
+        if assinatura == self._assinatura_mapeamentos: return
+        fornos = pd.DataFrame({'Forno': pd.Series([*self.base.categorias_forno, None], dtype=object)})
+        motivos = pd.DataFrame({'Motivo': pd.Series([*self.base.categorias_motivo, None], dtype=object)})
+        self._carregar_temporaria('fornos', _para_sql(aplicar_grupos_linhas(fornos, mapa_fornos, grupos_linhas)))
+        self._carregar_temporaria('motivos', _para_sql(aplicar_grupos_motivos(motivos, grupos_motivos)))
+        self._assinatura_mapeamentos = assinatura
+
+# --- CONSULTAS ---
+    def retidos_por_equipe(self, motivo):
+        return self.consultar("""
+            SELECT Equipe, SUM(m2_real) AS M2_Retido, SUM(qtd) AS Qtd_Ocorrencias
+            FROM resumo WHERE Motivo = ? AND Equipe IS NOT NULL
+            GROUP BY Equipe ORDER BY Equipe""", [motivo])
+
+    def ocorrencias_por_grupo(self, motivo):
+        return self.consultar(f"""
+            SELECT f.Grupo_Relatorio, SUM(r.qtd) AS Qtd_Ocorrencias
+            FROM resumo r {self._juncao}
+            WHERE r.Motivo = ? GROUP BY f.Grupo_Relatorio ORDER BY f.Grupo_Relatorio""", [motivo])
+
+    def top_causas(self, n=10, motivos_excluir=()):
+        # Mesmo formato de top_causas_por_grupo: {grupo: DataFrame(Grupo_Relatorio, Motivo_Analise, m2_real)}
+        marcadores = ', '.join('?' * len(motivos_excluir))
+        filtro = f"WHERE r.Motivo IS NULL OR r.Motivo NOT IN ({marcadores})" if motivos_excluir else ""
+        top = self.consultar(f"""
+            WITH somas AS (
+                SELECT f.Grupo_Relatorio, m.Motivo_Analise, SUM(r.m2_real) AS m2_real
+                FROM resumo r {self._juncao} {filtro}
+                GROUP BY f.Grupo_Relatorio, m.Motivo_Analise
+                HAVING m.Motivo_Analise IS NOT NULL
+            ), ordenadas AS (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY Grupo_Relatorio ORDER BY m2_real DESC) AS posicao FROM somas
+            )
+            SELECT Grupo_Relatorio, Motivo_Analise, m2_real FROM ordenadas
+            WHERE posicao <= ? ORDER BY m2_real DESC""", [*motivos_excluir, n])
+        return dict(tuple(top.groupby('Grupo_Relatorio', sort=False)))
+
+    def intervalo_dias(self, motivo):
+        intervalo = self.consultar("SELECT MIN(dia) AS inicio, MAX(dia) AS fim FROM retidos WHERE Motivo = ?", [motivo])
+        return pd.to_datetime(intervalo.iloc[0])
+
+    def detalhar_motivo(self, motivo, inicio=None, fim=None):
+        # Motivo × linha × dia no intervalo pedido (datas inclusivas)
+        return self.consultar(f"""
+            SELECT f.Grupo_Relatorio, f.Linha_Nome, r.dia, SUM(r.m2_real) AS M2_Retido, SUM(r.qtd) AS Qtd_Ocorrencias
+            FROM retidos r {self._juncao}
+            WHERE r.Motivo = ? AND r.dia BETWEEN ? AND ?
+            GROUP BY f.Grupo_Relatorio, f.Linha_Nome, r.dia ORDER BY r.dia, f.Linha_Nome""",
+            [motivo, (inicio or pd.Timestamp.min).strftime('%Y-%m-%d'), (fim or pd.Timestamp.max).strftime('%Y-%m-%d')])
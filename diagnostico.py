@@ -0,0 +1,114 @@
+# Instrumentação opcional das etapas do relatório: tempo de parede, linhas processadas e pico de memória
+# (tracemalloc) por etapa, acumulados por execução do script e, se pedido, anexados a um log JSON Lines
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+import pandas as pd
+
+# O tracemalloc é do processo inteiro (todas as sessões do servidor): fica ligado enquanto alguma sessão tiver
+# o diagnóstico ativo, e só uma execução por vez mede picos, porque o reset_peak de uma apagaria o pico da
+# outra. As execuções concorrentes medem só o tempo (pico vazio). Os picos incluem alocações de outras sessões
+_trava_rastreio = threading.Lock()
+_sessoes_medindo = set()
+_dono_pico = None
+
+def _atualizar_rastreio(sessao, ativo, sessao_ativa):
+    with _trava_rastreio:
+        _sessoes_medindo.difference_update([s for s in _sessoes_medindo if not sessao_ativa(s)])
+        if ativo: _sessoes_medindo.add(sessao)
+        else: _sessoes_medindo.discard(sessao)
+        if _sessoes_medindo and not tracemalloc.is_tracing(): tracemalloc.start()
+        if not _sessoes_medindo and _dono_pico is None and tracemalloc.is_tracing(): tracemalloc.stop()
+
+def _assumir_pico(diagnostico):
+    # Devolve True se 'diagnostico' pode medir picos agora (ninguém mede, ou ele mesmo numa etapa aninhada)
+    global _dono_pico
+    with _trava_rastreio:
+        if _dono_pico not in (None, diagnostico) or not tracemalloc.is_tracing(): return False
+        _dono_pico = diagnostico
+        return True
+
+def _liberar_pico():
+    global _dono_pico
+    with _trava_rastreio: _dono_pico = None
+
+def sem_medicao(nome, linhas=None):
+    # Substituto de Diagnostico.etapa quando a instrumentação está desligada
+    return nullcontext({})
+
+class Diagnostico:
+    def __init__(self, ativo=False, arquivo_log=None, adiados=None, sessao='local', sessao_ativa=lambda sessao: True):
+        # adiados: lista que sobrevive à execução (ex.: session_state) para etapas que rodam fora dela, como o download.
+        # sessao_ativa(sessao) -> bool: sessões encerradas com o diagnóstico ligado deixam de manter o rastreio
+        self.ativo = ativo
+        self.arquivo_log = arquivo_log
+        self.adiados = adiados if adiados is not None else []
+        self.execucao = datetime.now().isoformat(timespec='seconds')
+        self.etapas = {}
+        self._picos_externos = []  # etapas aninhadas: o reset_peak da interna não pode apagar o pico da externa
+        _atualizar_rastreio(sessao, ativo, sessao_ativa)
+
+    @contextmanager
+    def etapa(self, nome, linhas=None, adiada=False):
+        # Entrega um dicionário em que o chamador pode informar 'linhas' depois de processar
+        registro = {'linhas': linhas}
+        if not self.ativo:
+            yield registro
+            return
+        if not self._picos_externos and not _assumir_pico(self):
+            inicio = time.perf_counter()
+            try:
+                yield registro
+            finally:
+                self.registrar(nome, time.perf_counter() - inicio, registro['linhas'], None, adiada)
+            return
+        memoria_inicial, pico = tracemalloc.get_traced_memory()
+        if self._picos_externos: self._picos_externos[-1] = max(self._picos_externos[-1], pico)
+        self._picos_externos.append(0)
+        tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            segundos = time.perf_counter() - inicio
+            pico = max(tracemalloc.get_traced_memory()[1], self._picos_externos.pop())
+            if self._picos_externos: self._picos_externos[-1] = max(self._picos_externos[-1], pico)
+            else: _liberar_pico()
+            self.registrar(nome, segundos, registro['linhas'], max(pico - memoria_inicial, 0) / 1e6, adiada)
+
+    def registrar(self, nome, segundos, linhas, pico_mb, adiada=False):
+        # Etapas repetidas na mesma execução (blocos de CSV, um gráfico por grupo) são somadas numa linha só;
+        # pico_mb None = memória não medida (outra execução estava medindo)
+        if adiada:
+            self.adiados.append({'execucao': self.execucao, 'etapa': nome, 'chamadas': 1, 'segundos': segundos,
+                                 'linhas': linhas, 'pico_mb': pico_mb})
+        else:
+            registro = self.etapas.setdefault(nome, {'execucao': self.execucao, 'etapa': nome, 'chamadas': 0,
+                                                     'segundos': 0.0, 'linhas': None, 'pico_mb': None})
+            registro['chamadas'] += 1
+            registro['segundos'] += segundos
+            if linhas is not None: registro['linhas'] = (registro['linhas'] or 0) + linhas
+            if pico_mb is not None: registro['pico_mb'] = max(registro['pico_mb'] or 0.0, pico_mb)
+        if self.arquivo_log:
+            with open(self.arquivo_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'execucao': self.execucao, 'etapa': nome, 'segundos': round(segundos, 6),
+                                    'linhas': linhas, 'pico_mb': None if pico_mb is None else round(pico_mb, 3)},
+                                   ensure_ascii=False) + '\n')
+
+    def envolver(self, nome, funcao, adiada=False):
+        # Mede cada chamada de 'funcao'; as linhas vêm do primeiro argumento quando é um DataFrame
+        if not self.ativo: return funcao
+        @wraps(funcao)
+        def medida(*args, **kwargs):
+            linhas = len(args[0]) if args and isinstance(args[0], pd.DataFrame) else None
+            with self.etapa(nome, linhas, adiada):
+                return funcao(*args, **kwargs)
+        return medida
+
+    def resumo(self):
+        colunas = ['etapa', 'chamadas', 'segundos', 'linhas', 'pico_mb']
+        return pd.DataFrame(list(self.etapas.values()), columns=colunas + ['execucao'])[colunas]
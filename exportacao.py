@@ -0,0 +1,88 @@
+# Exportação do relatório para Excel com o xlsxwriter direto (sem pd.ExcelWriter):
+# modo constant_memory grava linha a linha e descarrega cada linha no disco temporário, então a memória
+# não cresce com o tamanho da planilha; números vão como números com formato nativo do Excel
+from io import BytesIO
+from datetime import datetime
+import xlsxwriter
+
+FORMATOS_NUMERO = {
+    'm2': '#,##0.00',
+    'pct': '0.00"%"',
+    'inteiro': '#,##0',
+    'data': 'dd/mm/yyyy',
+}
+
+# Coluna -> formato; colunas fora daqui são gravadas como texto
+FORMATO_COLUNAS = {
+    'M2_Produzido': 'm2', 'M2_Retido': 'm2', 'Meta_M2': 'm2', 'Saldo_M2': 'm2',
+    '% Realizado': 'pct',
+    'Qtd_Ocorrencias': 'inteiro', 'Ordem': 'inteiro',
+}
+
+LARGURA_MINIMA, LARGURA_MAXIMA = 10, 40
+LINHAS_POR_BLOCO_EXCEL = 20_000
+
+def escrever_planilha(workbook, nome, df, formatos, formato_cabecalho):
+    ws = workbook.add_worksheet(nome)
+    colunas = [str(c) for c in df.columns]
+    ws.write_row(0, 0, colunas, formato_cabecalho)
+
+    # Tipo e formato resolvidos uma vez por coluna; os valores viram listas Python bloco a bloco,
+    # assim a memória extra fica limitada ao bloco e não ao DataFrame inteiro
+    numericas = [df[coluna].dtype.kind in 'iufb' for coluna in df.columns]
+    fmts = [formatos.get(FORMATO_COLUNAS.get(nome)) for nome in colunas]
+    for c, nome in enumerate(colunas):
+        ws.set_column(c, c, min(max(LARGURA_MINIMA, len(nome) + 2), LARGURA_MAXIMA))
+
+    for inicio in range(0, len(df), LINHAS_POR_BLOCO_EXCEL):
+        bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO_EXCEL]
+        valores = [bloco[coluna].tolist() for coluna in bloco.columns]
+        for r, linha in enumerate(zip(*valores), start=inicio + 1):
+            for c, v in enumerate(linha):
+                if v is None or v != v: continue  # vazio/NaN: célula em branco
+                if numericas[c]: ws.write_number(r, c, v, fmts[c])
+                elif isinstance(v, datetime): ws.write_datetime(r, c, v, formatos['data'])  # inclui pd.Timestamp
+                else: ws.write_string(r, c, str(v))
+
+    ws.freeze_panes(1, 0)
+    if len(df): ws.autofilter(0, 0, len(df), len(colunas) - 1)
+
+def escrever_configuracao(workbook, config, formato_cabecalho):
+    ws = workbook.add_worksheet('Configuração')
+    ws.set_column(0, 0, 28)
+    ws.set_column(1, 1, 60)
+    ws.write_row(0, 0, ['Parâmetro', 'Valor'], formato_cabecalho)
+    linhas = [('Meta (%)', str(config.get('meta_pct', '')))]
+    if config.get('perfil'): linhas.append(('Perfil', config['perfil']))
+    linhas += [('Motivo excluído', m) for m in config.get('motivos_excluir', [])]
+    linhas += [(f"Grupo de defeitos: {g}", ", ".join(l)) for g, l in config.get('grupos_motivos', {}).items()]
+    linhas += [(f"Grupo de linhas: {g}", ", ".join(l)) for g, l in config.get('grupos_linhas', {}).items()]
+    linhas += [(f"Forno {f}", str(l)) for f, l in config.get('mapa_fornos', {}).items()]
+    for r, (parametro, valor) in enumerate(linhas, start=1):
+        ws.write_string(r, 0, parametro)
+        ws.write_string(r, 1, valor)
+
+def planilhas_relatorio(tabela_final, evolucao, cubo_ret):
+    # Abas do relatório: consolidado, evolução mensal e o detalhamento por motivo (direto do cubo de retidos)
+    motivos = cubo_ret.reset_index().rename(columns={'m2_real': 'M2_Retido', 'qtd': 'Qtd_Ocorrencias'})
+    return {
+        'Consolidado': tabela_final,
+        'Evolução Mensal': evolucao.sort_values(['Grupo_Relatorio', 'mes_ano', 'Equipe']),
+        'Motivos': motivos,
+    }
+
+def exportar_excel(planilhas, config=None, destino=None):
+    # planilhas: {nome da aba: DataFrame}, gravadas na ordem do dicionário.
+    # destino: caminho do arquivo; sem destino grava num BytesIO e o devolve posicionado no início
+    saida = destino if destino is not None else BytesIO()
+    workbook = xlsxwriter.Workbook(saida, {'constant_memory': True})
+    formatos = {k: workbook.add_format({'num_format': v}) for k, v in FORMATOS_NUMERO.items()}
+    formato_cabecalho = workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#2E86C1', 'align': 'center'})
+
+    for nome, df in planilhas.items():
+        if df is not None: escrever_planilha(workbook, nome[:31], df, formatos, formato_cabecalho)
+    if config is not None: escrever_configuracao(workbook, config, formato_cabecalho)
+    workbook.close()
+
+    if destino is None: saida.seek(0)
+    return saida
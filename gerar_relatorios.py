@@ -0,0 +1,111 @@
+# Geração em lote dos relatórios de retidos, sem abrir o dashboard:
+#   python gerar_relatorios.py --planta PlantaA prod_a.xlsx ret_a.csv --planta PlantaB prod_b.xlsx ret_b.xlsx \
+#       --linhas linhas.json --defeitos defeitos.json --metas metas.json --saida relatorios --processos 4
+# Cada planta roda num processo separado; o cálculo é o mesmo do GeradorRelatorio.py (calculos.py)
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import graficos
+from calculos import ler_e_agregar, calcular_relatorio
+from exportacao import planilhas_relatorio, exportar_excel
+from perfis import carregar_perfil
+
+# --- CONFIGURAÇÃO ---
+# linhas.json:   {"mapa_fornos": {"F1": "Linha 1", ...}, "grupos_linhas": {"Grupo A": ["Linha 1", ...]}}
+# defeitos.json: {"grupos_motivos": {"Trinca": ["Trinca A", ...]}, "motivos_excluir": ["Teste"]}
+# metas.json:    {"meta_pct": 0.5}
+CHAVES_CONFIG = {
+    'linhas': ['mapa_fornos', 'grupos_linhas'],
+    'defeitos': ['grupos_motivos', 'motivos_excluir'],
+    'metas': ['meta_pct'],
+}
+
+def carregar_config(args):
+    # Perfil salvo (NOME ou NOME:VERSAO) primeiro; os arquivos JSON, se passados, sobrepõem suas chaves
+    config = {}
+    if args.perfil:
+        nome, _, versao = args.perfil.partition(':')
+        perfil = carregar_perfil(nome, int(versao) if versao else None)
+        if perfil is None: raise SystemExit(f"Perfil não encontrado: {args.perfil}")
+        config.update(perfil['config'], perfil=f"{nome} (v{perfil['versao']})")
+    for opcao, chaves in CHAVES_CONFIG.items():
+        caminho = getattr(args, opcao)
+        if not caminho: continue
+        with open(caminho, encoding='utf-8') as f: dados = json.load(f)
+        config.update({k: dados[k] for k in chaves if k in dados})
+    return config
+
+# --- SAÍDAS ---
+def montar_html(nome_planta, relatorio):
+    meta_pct = relatorio['meta_pct']
+    tabela = relatorio['tabela_final']
+    tabela_por_grupo = dict(tuple(tabela.groupby('Grupo_Relatorio', sort=False, observed=True))) if not tabela.empty else {}
+    evolucao_por_grupo = dict(tuple(relatorio['evolucao'].groupby('Grupo_Relatorio', sort=False, observed=True)))
+
+    # Tabela em páginas de tamanho fixo: na impressão nenhuma linha fica escondida na rolagem da figura
+    figuras = [graficos.criar_tabela_grafica(tabela, meta_pct, pagina, graficos.LINHAS_POR_PAGINA)
+               for pagina in range(graficos.paginas_tabela(tabela))]
+    for grupo in relatorio['grupos']:
+        if grupo in tabela_por_grupo: figuras.append(graficos.criar_grafico_pct_grupo(tabela_por_grupo[grupo], grupo, meta_pct))
+        figuras.append(graficos.criar_grafico_evolucao_com_geral(evolucao_por_grupo.get(grupo), grupo, meta_pct))
+        if grupo in relatorio['top_causas']: figuras.append(graficos.criar_grafico_top_causas(relatorio['top_causas'][grupo], grupo))
+
+    # plotly.js vem do CDN uma única vez, no primeiro gráfico
+    partes = [fig.to_html(full_html=False, include_plotlyjs='cdn' if i == 0 else False)
+              for i, fig in enumerate(f for f in figuras if f is not None)]
+    return (f"<html><head><meta charset='utf-8'><title>Relatório de Retidos - {nome_planta}</title></head><body>"
+            f"<h1>Relatório de Retidos - {nome_planta}</h1><p>Meta: {meta_pct}%</p>"
+            + "\n".join(partes) + "</body></html>")
+
+def gerar_planta(nome_planta, arquivo_prod, arquivo_ret, config, pasta_saida):
+    # Executa dentro do processo filho: lê, calcula e grava os arquivos da planta
+    parciais = {}
+    for tipo, caminho in (('producao', arquivo_prod), ('retidos', arquivo_ret)):
+        with open(caminho, 'rb') as arquivo:
+            parciais[tipo] = ler_e_agregar(arquivo, tipo)
+        if parciais[tipo] is None: raise ValueError(f"Não foi possível ler {caminho}")
+        if parciais[tipo].attrs.get('datas_invalidas'):
+            print(f"⚠️ {nome_planta}: {parciais[tipo].attrs['datas_invalidas']} linhas com data não reconhecida em {caminho}", file=sys.stderr)
+
+    relatorio = calcular_relatorio(parciais['producao'], parciais['retidos'], config)
+
+    base = os.path.join(pasta_saida, nome_planta)
+    planilhas = planilhas_relatorio(relatorio['tabela_final'], relatorio['evolucao'], relatorio['cubo_ret'])
+    exportar_excel(planilhas, dict(config, meta_pct=relatorio['meta_pct']), destino=base + '.xlsx')
+    with open(base + '.html', 'w', encoding='utf-8') as f:
+        f.write(montar_html(nome_planta, relatorio))
+    return nome_planta, len(relatorio['tabela_final'])
+
+# --- ENTRADA ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera os relatórios de retidos (Excel + HTML) para várias plantas em paralelo.")
+    parser.add_argument('--planta', nargs=3, action='append', required=True, metavar=('NOME', 'PRODUCAO', 'RETIDOS'),
+                        help="nome da planta, arquivo de produção e arquivo de retidos (repita para cada planta)")
+    parser.add_argument('--perfil', help="perfil salvo no dashboard (NOME ou NOME:VERSAO)")
+    parser.add_argument('--linhas', help="JSON com mapa_fornos e grupos_linhas")
+    parser.add_argument('--defeitos', help="JSON com grupos_motivos e motivos_excluir")
+    parser.add_argument('--metas', help="JSON com meta_pct")
+    parser.add_argument('--saida', default='relatorios', help="pasta de saída (padrão: relatorios)")
+    parser.add_argument('--processos', type=int, default=None, help="número de processos (padrão: núcleos da CPU)")
+    args = parser.parse_args(argv)
+
+    config = carregar_config(args)
+    os.makedirs(args.saida, exist_ok=True)
+
+    falhas = 0
+    with ProcessPoolExecutor(max_workers=args.processos) as executor:
+        tarefas = {executor.submit(gerar_planta, nome, prod, ret, config, args.saida): nome for nome, prod, ret in args.planta}
+        for tarefa in as_completed(tarefas):
+            try:
+                nome, linhas = tarefa.result()
+                print(f"✅ {nome}: {linhas} linhas -> {os.path.join(args.saida, nome)}.xlsx/.html")
+            except Exception as e:
+                falhas += 1
+                print(f"❌ {tarefas[tarefa]}: {e}", file=sys.stderr)
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
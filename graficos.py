@@ -0,0 +1,142 @@
+# Construção das figuras Plotly do relatório (sem Streamlit; o dashboard as memoriza com st.cache_data)
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+TEMPLATE_GRAFICO = "plotly_white"
+
+# --- LIMITES DE RENDERIZAÇÃO (o que vai para o navegador não cresce com os dados) ---
+LIMITE_WEBGL = 1000        # séries com mais pontos usam Scattergl
+MAX_PONTOS_SERIE = 1500    # séries temporais mais longas são reduzidas no servidor
+MAX_ROTULOS = 60           # acima disto os valores ficam só no hover, sem texto em cada barra/ponto
+MAX_COLUNAS_MAPA = 366     # mapas de calor com mais dias passam a semanas
+LINHAS_POR_PAGINA = 12     # linhas da tabela consolidada por página (cabem nos 400 px da figura)
+
+def tipo_dispersao(pontos):
+    return go.Scattergl if pontos > LIMITE_WEBGL else go.Scatter
+
+def reduzir_serie(df, coluna, max_pontos=MAX_PONTOS_SERIE):
+    # Divide a série (já ordenada) em faixas e mantém, de cada uma, as linhas de mínimo e de máximo da coluna:
+    # picos sobrevivem à redução, que uma média apagaria
+    if len(df) <= max_pontos: return df
+    valores = df[coluna].reset_index(drop=True)
+    faixas = np.arange(len(valores)) * (max_pontos // 2) // len(valores)
+    minimos = valores.fillna(np.inf).groupby(faixas).idxmin()
+    maximos = valores.fillna(-np.inf).groupby(faixas).idxmax()
+    return df.iloc[np.union1d(minimos.to_numpy(), maximos.to_numpy())]
+
+def paginas_tabela(df, linhas_por_pagina=LINHAS_POR_PAGINA):
+    return max(1, -(-len(df) // linhas_por_pagina))
+
+def criar_grafico_pct_grupo(df_g, nome_grupo, meta_pct):
+    mapa_cores = {'Dentro da Meta (Verde)': '#27AE60', 'Fora da Meta (Vermelho)': '#E74C3C'}
+    fig = go.Figure(go.Bar(x=df_g['Equipe'], y=df_g['% Realizado'],
+                           marker_color=[mapa_cores.get(s, '#333') for s in df_g['Status']],
+                           text=[f"{v:.2f}" for v in df_g['% Realizado']], textposition='inside'))
+    # AJUSTE: Cor do texto da meta (Preto)
+    fig.add_hline(y=meta_pct, line_dash="dot", 
+                  annotation_text=f"Meta: {meta_pct}%", 
+                  annotation_position="top right",
+                  annotation_font_color="black")
+    fig.update_layout(title=f"{nome_grupo}: % ", template=TEMPLATE_GRAFICO)
+    return fig
+
+def criar_grafico_top_causas(top, nome_grupo):
+    return px.bar(top, y='Motivo_Analise', x='m2_real', orientation='h', title=f"Top 10 - {nome_grupo}", text_auto='.2f', template=TEMPLATE_GRAFICO)
+
+def criar_tabela_grafica(df, meta_pct, pagina=0, linhas_por_pagina=None):
+    # Com linhas_por_pagina, só a página pedida entra na figura (as demais não são enviadas)
+    if df.empty: return None
+    if linhas_por_pagina: df = df.iloc[pagina * linhas_por_pagina:(pagina + 1) * linhas_por_pagina]
+    cor_texto_pct = ['#E74C3C' if v > meta_pct else '#27AE60' for v in df['% Realizado']]
+    cor_texto_saldo = ['#E74C3C' if v < 0 else '#27AE60' for v in df['Saldo_M2']]
+    
+    fig = go.Figure(data=[go.Table(
+        header=dict(values=['<b>Grupo</b>', '<b>Equipe</b>', '<b>Produção</b>', '<b>Meta (m²)</b>', '<b>Retido (m²)</b>', '<b>Saldo</b>', '<b>% Perda</b>'],
+                    fill_color='#2E86C1', align='center', font=dict(color='white', size=12)),
+        cells=dict(values=[df['Grupo_Relatorio'], df['Equipe'], 
+                           [f"{v:,.2f}" for v in df['M2_Produzido']], 
+                           [f"{v:,.2f}" for v in df['Meta_M2']], 
+                           [f"{v:,.2f}" for v in df['M2_Retido']], 
+                           [f"{v:,.2f}" for v in df['Saldo_M2']], 
+                           [f"{v:.2f}%" for v in df['% Realizado']]],
+                   fill_color='#F7F9F9', align='center',
+                   font=dict(color=['black', 'black', 'black', 'black', 'black', cor_texto_saldo, cor_texto_pct], size=11),
+                   height=30))])
+    fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), height=400)
+    return fig
+
+def criar_grafico_evolucao_com_geral(df_evolucao, nome_grupo, meta_pct):
+    # df_evolucao: fatia do grupo vinda de montar_evolucao (já agrupada por Mês/Equipe)
+    if df_evolucao is None or df_evolucao.empty: return None
+    
+    # Um único assign acrescenta as colunas auxiliares sem copiar a fatia recebida
+    meta_m2 = df_evolucao['M2_Produzido'] * (meta_pct / 100)
+    df_final = df_evolucao.assign(
+        Meta_M2=meta_m2,
+        Cor_Barra=np.where(df_evolucao['M2_Retido'] <= meta_m2, '#27AE60', '#E74C3C'),
+        Ordem_Equipe=(df_evolucao['Equipe'] == 'Média Geral').astype(int),
+        # --- ALTERAÇÃO AQUI: Apenas o nome da equipe no Label_X ---
+        Label_X=df_evolucao['Equipe'].astype(str),
+    ).sort_values(by=['mes_ano', 'Ordem_Equipe', 'Equipe'])
+    
+    # Muitos pontos: sem texto fixo (os valores ficam no hover) e linha da meta em WebGL
+    com_rotulos = len(df_final) <= MAX_ROTULOS
+    fig = go.Figure()
+    # Barra Retido
+    fig.add_trace(go.Bar(x=df_final['Label_X'], y=df_final['M2_Retido'], marker_color=df_final['Cor_Barra'],
+                         text=[f"{v:,.2f}" for v in df_final['M2_Retido']] if com_rotulos else None,
+                         textposition='inside', name='Realizado'))
+    
+    # Linha Meta com Texto (Preto)
+    fig.add_trace(tipo_dispersao(len(df_final))(
+        x=df_final['Label_X'], 
+        y=df_final['Meta_M2'], 
+        mode='lines+markers+text' if com_rotulos else 'lines+markers',
+        text=[f"{v:,.1f}" for v in df_final['Meta_M2']] if com_rotulos else None, 
+        textposition="top center",
+        textfont=dict(color='black'), 
+        marker=dict(symbol='line-ew', color='black', size=10, line=dict(width=2)), 
+        line=dict(color='black', dash='dot'),
+        name='Meta M²'
+    ))
+    
+    max_val = max(df_final['M2_Retido'].max(), df_final['Meta_M2'].max()) if not df_final.empty else 100
+    fig.update_layout(title=f"{nome_grupo}: M²", yaxis=dict(range=[0, max_val * 1.3]), template=TEMPLATE_GRAFICO, showlegend=True)
+    return fig
+
+def criar_grafico_controle(df_ge, titulo):
+    # df_ge: fatia de um Grupo/Equipe vinda de calcular_tendencias (taxa, média móvel e limites em %)
+    if df_ge is None or df_ge.empty: return None
+    # Séries longas: mínimo/máximo da taxa por faixa; os sinais fora de controle são sempre desenhados todos
+    fora = df_ge[df_ge['Fora_Controle']]
+    reduzida = reduzir_serie(df_ge, 'Taxa')
+    dispersao = tipo_dispersao(len(reduzida))
+    nome_taxa = 'Taxa de Retenção' if len(reduzida) == len(df_ge) else 'Taxa de Retenção (mín./máx. por faixa)'
+    fig = go.Figure()
+    fig.add_trace(dispersao(x=reduzida['periodo'], y=reduzida['Taxa'], mode='lines+markers', name=nome_taxa,
+                            line=dict(color='#2E86C1', width=1), marker=dict(size=5)))
+    fig.add_trace(dispersao(x=reduzida['periodo'], y=reduzida['Media_Movel'], mode='lines', name='Média Móvel',
+                            line=dict(color='#F39C12', width=2)))
+    # Limites variam com a produção de cada período: degraus em vez de retas (Scattergl não desenha degraus)
+    fig.add_trace(go.Scatter(x=reduzida['periodo'], y=reduzida['LC'], mode='lines', name='LC', line=dict(color='black', shape='hv')))
+    for limite in ['LCS', 'LCI']:
+        fig.add_trace(go.Scatter(x=reduzida['periodo'], y=reduzida[limite], mode='lines', name=limite,
+                                 line=dict(color='#7F8C8D', dash='dash', shape='hv')))
+    fig.add_trace(tipo_dispersao(len(fora))(x=fora['periodo'], y=fora['Taxa'], mode='markers', name='Fora de Controle',
+                                            marker=dict(color='#E74C3C', size=10, symbol='x')))
+    fig.update_layout(title=titulo, yaxis_title='% Retido', template=TEMPLATE_GRAFICO, hovermode='x unified')
+    return fig
+
+def criar_mapa_calor_motivo(detalhe, motivo):
+    # detalhe: linhas Linha_Nome × dia vindas do motor de consultas (BaseConsultas.detalhar_motivo)
+    if detalhe is None or detalhe.empty: return None
+    semanal = detalhe['dia'].nunique() > MAX_COLUNAS_MAPA
+    if semanal: detalhe = detalhe.assign(dia=detalhe['dia'] - pd.to_timedelta(detalhe['dia'].dt.weekday, unit='D'))
+    matriz = detalhe.pivot_table(index='Linha_Nome', columns='dia', values='M2_Retido', aggfunc='sum')
+    fig = go.Figure(go.Heatmap(z=matriz.to_numpy(), x=matriz.columns, y=matriz.index, colorscale='Reds',
+                               colorbar=dict(title='m²'), hovertemplate='%{y}<br>%{x|%d/%m/%Y}<br>%{z:,.2f} m²<extra></extra>'))
+    fig.update_layout(title=f"{motivo}: M² Retido por Linha e {'Semana' if semanal else 'Dia'}", template=TEMPLATE_GRAFICO,
+                      height=max(300, 40 * len(matriz.index) + 120))
+    return fig
@@ -0,0 +1,65 @@
+# Perfis de configuração salvos em disco (um arquivo JSON): forno -> linha, grupos de linhas e grupos de defeitos,
+# com o histórico de versões de cada perfil, para relatórios reproduzíveis. Só a configuração é guardada: as
+# tabelas de consulta (inverter_grupos) custam microssegundos e são montadas na hora, como sem perfil
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+ARQUIVO_PERFIS = os.environ.get('RETIDOS_PERFIS', 'perfis_retidos.json')
+CHAVES_PERFIL = ['mapa_fornos', 'grupos_linhas', 'grupos_motivos']
+# Todas as sessões do dashboard rodam no mesmo processo: ler-alterar-gravar passa por esta trava,
+# então dois supervisores salvando ao mesmo tempo não perdem versões
+_trava_escrita = threading.Lock()
+
+def ler_perfis(arquivo=ARQUIVO_PERFIS):
+    if not os.path.exists(arquivo): return {'padrao': None, 'perfis': {}}
+    with open(arquivo, encoding='utf-8') as f: return json.load(f)
+
+def gravar_perfis(dados, arquivo=ARQUIVO_PERFIS):
+    # Grava num temporário próprio (nome único, mesma pasta) e troca de uma vez: um leitor nunca vê o arquivo
+    # pela metade e duas gravações não se misturam
+    pasta = os.path.dirname(os.path.abspath(arquivo))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=pasta, suffix='.tmp', delete=False) as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2)
+    try: os.replace(f.name, arquivo)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+def listar_perfis(arquivo=ARQUIVO_PERFIS):
+    return sorted(ler_perfis(arquivo)['perfis'])
+
+def listar_versoes(nome, arquivo=ARQUIVO_PERFIS):
+    return [{'versao': v['versao'], 'salvo_em': v['salvo_em']} for v in ler_perfis(arquivo)['perfis'].get(nome, [])]
+
+def carregar_perfil(nome, versao=None, arquivo=ARQUIVO_PERFIS):
+    # Sem versão, a mais recente. Devolve {'nome', 'versao', 'salvo_em', 'config'} ou None
+    versoes = ler_perfis(arquivo)['perfis'].get(nome, [])
+    escolhidas = [v for v in versoes if versao is None or v['versao'] == versao]
+    return dict(escolhidas[-1], nome=nome) if escolhidas else None
+
+def salvar_perfil(nome, config, arquivo=ARQUIVO_PERFIS):
+    # Acrescenta uma versão nova só se a configuração mudou; devolve o número da versão vigente
+    config = {k: config.get(k, {}) for k in CHAVES_PERFIL}
+    with _trava_escrita:
+        dados = ler_perfis(arquivo)
+        versoes = dados['perfis'].setdefault(nome, [])
+        if versoes and versoes[-1]['config'] == config: return versoes[-1]['versao']
+        versoes.append({
+            'versao': versoes[-1]['versao'] + 1 if versoes else 1,
+            'salvo_em': datetime.now().isoformat(timespec='seconds'),
+            'config': config,
+        })
+        gravar_perfis(dados, arquivo)
+        return versoes[-1]['versao']
+
+def perfil_padrao(arquivo=ARQUIVO_PERFIS):
+    return ler_perfis(arquivo).get('padrao')
+
+def definir_padrao(nome, arquivo=ARQUIVO_PERFIS):
+    with _trava_escrita:
+        dados = ler_perfis(arquivo)
+        dados['padrao'] = nome
+        gravar_perfis(dados, arquivo)